@@ -0,0 +1,140 @@
+"""
+Reading and writing zip and tar(.gz) template bundles in memory.
+
+Members are read one at a time and written to the output archive as they
+come, so a bundle is transformed without extracting it to disk. The input
+and output formats are chosen by file extension and may differ. zipfile and
+tarfile are only imported once an archive is actually read or written.
+"""
+import collections
+import io
+import time
+
+ARCHIVE_FORMATS = {
+    '.zip': 'zip',
+    '.tar.gz': 'tar.gz',
+    '.tgz': 'tar.gz',
+    '.tar': 'tar',
+}
+
+# Zip timestamps cannot predate 1980
+ZIP_EPOCH = time.mktime((1980, 1, 1, 0, 0, 0, 0, 0, -1))
+
+Member = collections.namedtuple('Member', ['name', 'mtime', 'mode', 'is_dir'])
+
+
+def archive_format(path):
+    """
+    Return 'zip', 'tar.gz' or 'tar' for an archive path, or None.
+    """
+    lower = path.lower()
+    for suffix, fmt in ARCHIVE_FORMATS.items():
+        if lower.endswith(suffix):
+            return fmt
+    return None
+
+
+def templated_archive_name(path):
+    """
+    Return the default output path for an archive: bundle.zip -> bundle_templated.zip.
+    """
+    lower = path.lower()
+    for suffix in ARCHIVE_FORMATS:
+        if lower.endswith(suffix):
+            return path[:-len(suffix)] + '_templated' + path[-len(suffix):]
+    return path + '_templated'
+
+
+def read_members(path):
+    """
+    Yield (Member, data) for every file and directory in the archive at
+    ``path``, in archive order. ``data`` is None for directories. Tar
+    archives are read as a stream; links and special files are skipped.
+    """
+    import tarfile
+    import zipfile
+
+    if archive_format(path) == 'zip':
+        with zipfile.ZipFile(path) as zf:
+            for info in zf.infolist():
+                mtime = time.mktime(info.date_time + (0, 0, -1))
+                mode = (info.external_attr >> 16) & 0o7777
+                if info.is_dir():
+                    yield Member(info.filename, mtime, mode or 0o755, True), None
+                else:
+                    yield Member(info.filename, mtime, mode or 0o644, False), zf.read(info)
+        return
+
+    with tarfile.open(path, 'r|*') as tf:
+        for info in tf:
+            # Archives made with ``tar -C dir .`` prefix every name with ./
+            name = info.name[2:] if info.name.startswith('./') else info.name
+            if not name or name == '.':
+                continue
+            if info.isdir():
+                yield Member(name + '/', info.mtime, info.mode, True), None
+            elif info.isfile():
+                yield Member(name, info.mtime, info.mode, False), tf.extractfile(info).read()
+
+
+def read_member(path, name):
+    """
+    Return the data of the file member ``name`` of the archive at ``path``.
+    """
+    for member, data in read_members(path):
+        if member.name == name and not member.is_dir:
+            return data
+    raise KeyError(f"{name} not found in {path}")
+
+
+class ArchiveWriter:
+    """
+    Writes members to a zip, tar.gz or tar archive, chosen by the extension
+    of ``path``.
+    """
+
+    def __init__(self, path):
+        import tarfile
+        import zipfile
+
+        self.format = archive_format(path)
+        if self.format is None:
+            raise ValueError(f"Unsupported archive type: {path}")
+        if self.format == 'zip':
+            self._archive = zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED)
+        else:
+            self._archive = tarfile.open(path, 'w:gz' if self.format == 'tar.gz' else 'w')
+
+    def add(self, member, data):
+        import tarfile
+        import zipfile
+
+        if self.format == 'zip':
+            info = zipfile.ZipInfo(member.name, time.localtime(max(member.mtime, ZIP_EPOCH))[:6])
+            info.external_attr = (member.mode & 0o7777) << 16
+            if member.is_dir:
+                info.external_attr |= 0x10
+                self._archive.writestr(info, b'')
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+                self._archive.writestr(info, data)
+            return
+
+        info = tarfile.TarInfo(member.name.rstrip('/'))
+        info.mtime = member.mtime
+        info.mode = member.mode
+        if member.is_dir:
+            info.type = tarfile.DIRTYPE
+            self._archive.addfile(info)
+        else:
+            info.size = len(data)
+            self._archive.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        self._archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
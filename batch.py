@@ -0,0 +1,121 @@
+"""
+Recursive template discovery and the checkpoint journal for batch runs.
+
+Templates are found with an ``os.scandir`` generator that visits each
+directory's entries in name order, so a run produces files in a fixed order
+without ever listing the whole tree. As results come back in that same
+order, the journal only has to remember the last finished file (and any that
+failed) for ``--resume`` to skip everything up to it.
+"""
+import fnmatch
+import json
+import os
+
+DEFAULT_INCLUDE = ('*.html',)
+DEFAULT_EXCLUDE = ('*_templated.html',)
+JOURNAL_NAME = '.email_transformer_journal.jsonl'
+
+
+def _matches(path, patterns):
+    # Case-insensitive like the extension checks elsewhere, so A.HTML is a template
+    path = path.lower()
+    return any(fnmatch.fnmatchcase(path, pattern.lower()) for pattern in patterns)
+
+
+def iter_templates(root, include=DEFAULT_INCLUDE, exclude=DEFAULT_EXCLUDE, skip_dirs=()):
+    """
+    Yield (relative_path, excluded) for the files under ``root`` whose
+    relative path matches one of the ``include`` globs, depth first in name
+    order. ``excluded`` is True for files that also match an ``exclude``
+    glob. Globs are matched case-insensitively against the path relative to
+    ``root`` with '/' separators, and ``*`` also matches across directories. A directory is
+    skipped entirely when ``dir/`` matches an exclude glob or its real path
+    is in ``skip_dirs``.
+    """
+    skip_dirs = {os.path.realpath(path) for path in skip_dirs}
+    stack = [('', iter(sorted(os.scandir(root), key=lambda entry: entry.name)))]
+    while stack:
+        prefix, entries = stack[-1]
+        entry = next(entries, None)
+        if entry is None:
+            stack.pop()
+            continue
+
+        relative = prefix + entry.name
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            continue
+        if is_dir:
+            if _matches(relative + '/', exclude) or os.path.realpath(entry.path) in skip_dirs:
+                continue
+            try:
+                children = sorted(os.scandir(entry.path), key=lambda child: child.name)
+            except OSError:
+                continue
+            stack.append((relative + '/', iter(children)))
+        elif _matches(relative, include):
+            yield relative.replace('/', os.sep), _matches(relative, exclude)
+
+
+def order_key(relative_path):
+    """
+    Sort key matching the order iter_templates yields paths in.
+    """
+    return tuple(relative_path.split(os.sep))
+
+
+class Journal:
+    """
+    Append-only record of finished files, one JSON object per line.
+
+    With ``resume=True`` an existing journal is read back (keeping only the
+    last finished path and the set of failed ones) and appended to;
+    otherwise it is started afresh.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.last = None
+        self.failed = set()
+        mode = 'w'
+        if resume and os.path.exists(path):
+            self._load()
+            mode = 'a'
+        self.file = open(path, mode, encoding='utf-8')
+
+    def _load(self):
+        with open(self.path, 'rb+') as f:
+            data_end = 0
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                data_end += len(line)
+                entry = json.loads(line)
+                # Retried failures are appended after later paths
+                key = order_key(entry['path'])
+                if self.last is None or key > self.last:
+                    self.last = key
+                if entry['status'] == 'failed':
+                    self.failed.add(entry['path'])
+                else:
+                    self.failed.discard(entry['path'])
+            # Drop a line left half-written by a crash
+            f.truncate(data_end)
+
+    def finished(self, relative_path):
+        """
+        Return True if a previous run already finished ``relative_path``
+        successfully.
+        """
+        return (self.last is not None and order_key(relative_path) <= self.last
+                and relative_path not in self.failed)
+
+    def append(self, relative_path, record):
+        self.file.write(json.dumps({
+            'path': relative_path, 'status': record['status'], 'seconds': record['seconds'],
+        }) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,5 @@
+"""
+Benchmarks and compatibility checks for the email template transformer.
+
+Run the modules from the repository root, e.g. ``python -m benchmarks.parsers``.
+"""
@@ -0,0 +1,144 @@
+"""
+Synthetic email corpus generator.
+
+Takes a real export (new-task.html by default) as the seed and scales one
+dimension at a time: number of <img> tags, <style> blocks, inline-style
+elements, nesting depth and overall document size. Generation is
+deterministic for a given random seed.
+
+    python -m benchmarks.corpus ./bench_corpus [--seed-file new-task.html]
+"""
+import argparse
+import json
+import os
+import random
+
+DEFAULT_SEED_FILE = 'new-task.html'
+
+# Levels generated for each dimension by ``build_corpus``
+DEFAULT_LEVELS = {
+    'images': [10, 100, 1000],
+    'style_blocks': [5, 50, 200],
+    'inline_styles': [100, 1000, 5000],
+    'depth': [10, 50, 200],
+    'size': [2, 5, 10],
+}
+
+FONTS = ['Georgia, serif', "'Helvetica Neue', sans-serif", 'Verdana', "'Open Sans', Arial"]
+
+
+def _image(rng, index):
+    kind = rng.randrange(4)
+    if kind == 0:
+        return f'<img src="https://cdn.example.com/{index}.png" width="{rng.randint(50, 600)}" height="{rng.randint(50, 400)}" alt="Image {index}">'
+    if kind == 1:
+        return f'<img src="https://cdn.example.com/{index}.jpg" style="width: {rng.randint(50, 600)}px; border: 0" alt="Image {index}">'
+    if kind == 2:
+        return f'<img src="https://cdn.example.com/{index}.gif" class="bench-img-{rng.randrange(50)} responsive" alt="">'
+    return f'<img src="https://cdn.example.com/{index}.webp" class="size-{rng.randint(50, 600)}x{rng.randint(50, 400)}">'
+
+
+def _style_block(rng, index):
+    rules = []
+    for n in range(20):
+        rules.append(
+            f'.bench-img-{(index * 20 + n) % 50} {{ width: {rng.randint(50, 600)}px; '
+            f'height: {rng.randint(50, 400)}px; font-family: {rng.choice(FONTS)}; }}'
+        )
+    rules.append(f'.bench-bg-{index} {{ background-image: url("https://cdn.example.com/bg{index}.png"); }}')
+    rules.append(f'@media (max-width: 480px) {{ .bench-col-{index} {{ width: 100% !important; }} }}')
+    return '<style>\n' + '\n'.join(rules) + '\n</style>'
+
+
+def _inline_style_element(rng, index):
+    return (
+        f'<div style="font-family: {rng.choice(FONTS)}; color: #{rng.randrange(0xffffff):06x}; '
+        f'background: url(https://cdn.example.com/tile{index % 7}.png) repeat; padding: {rng.randrange(20)}px">'
+        f'<span style="font-size: {rng.randint(10, 24)}px; line-height: 1.4">Paragraph {index} of generated copy.</span>'
+        f'</div>'
+    )
+
+
+def _nested_block(depth):
+    opening = ''.join(
+        '<table role="presentation"><tr><td style="padding: 0">' if level % 2 == 0 else '<div><span>'
+        for level in range(depth)
+    )
+    closing = ''.join(
+        '</td></tr></table>' if level % 2 == 0 else '</span></div>'
+        for level in reversed(range(depth))
+    )
+    return opening + '<p>Deeply nested <a href="https://example.com/deep">link</a> text.</p>' + closing
+
+
+def generate(seed_html, images=0, style_blocks=0, inline_styles=0, depth=0, size=1, seed=0):
+    """
+    Return a new document derived from ``seed_html``.
+
+    ``size`` repeats the seed's body content that many times; the other
+    parameters add that many generated elements of each kind.
+    """
+    rng = random.Random(seed)
+    head_end = seed_html.lower().rfind('</head>')
+    body_start = seed_html.lower().find('<body')
+    body_open_end = seed_html.find('>', body_start) + 1
+    body_end = seed_html.lower().rfind('</body>')
+
+    head = seed_html[:head_end]
+    body_content = seed_html[body_open_end:body_end]
+
+    parts = [head]
+    parts.extend(_style_block(rng, i) for i in range(style_blocks))
+    parts.append(seed_html[head_end:body_open_end])
+    parts.extend(body_content for _ in range(size))
+    parts.extend(_image(rng, i) for i in range(images))
+    parts.extend(_inline_style_element(rng, i) for i in range(inline_styles))
+    if depth:
+        parts.append(_nested_block(depth))
+    parts.append(seed_html[body_end:])
+    return ''.join(parts)
+
+
+def build_corpus(output_dir, seed_html, levels=None, seed=0):
+    """
+    Write one document per (dimension, level) plus the unmodified seed into
+    ``output_dir``, together with a manifest.json describing each file.
+    Returns the manifest entries.
+    """
+    levels = levels or DEFAULT_LEVELS
+    os.makedirs(output_dir, exist_ok=True)
+
+    documents = [('seed', {})]
+    for dimension, values in levels.items():
+        for value in values:
+            documents.append((f'{dimension}-{value}', {dimension: value}))
+
+    manifest = []
+    for name, params in documents:
+        html = generate(seed_html, seed=seed, **params)
+        path = os.path.join(output_dir, f'{name}.html')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(html)
+        manifest.append({'name': name, 'file': os.path.basename(path), 'params': params,
+                         'bytes': len(html.encode('utf-8'))})
+
+    with open(os.path.join(output_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic email corpus for benchmarking.')
+    parser.add_argument('output_dir', help='Directory to write the corpus into')
+    parser.add_argument('--seed-file', default=DEFAULT_SEED_FILE, help='Real template to derive documents from')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+
+    with open(args.seed_file, encoding='utf-8') as f:
+        seed_html = f.read()
+    for entry in build_corpus(args.output_dir, seed_html, seed=args.seed):
+        print(f"{entry['file']:<24} {entry['bytes'] // 1024:>7} KB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Compare BeautifulSoup tree builders on email templates.
+
+For every parser the script checks that MSO conditional comments, the
+xmlns:o / xmlns:v namespace declarations and namespaced VML/Office elements
+survive exactly as they do with html.parser, that the transformed output is
+identical, and reports parse and end-to-end throughput.
+
+    python -m benchmarks.parsers new-task.html [more.html ...] [--repeat 20]
+"""
+import argparse
+import sys
+import time
+
+from bs4 import BeautifulSoup, Comment
+from bs4.exceptions import FeatureNotFound
+
+from defaults import PARSERS
+from engine import normalize_html
+from main import transform_html
+
+REFERENCE_PARSER = 'html.parser'
+
+
+def conditional_comments(soup):
+    return [str(c) for c in soup.find_all(string=lambda s: isinstance(s, Comment))
+            if '[if' in c or '[endif]' in c]
+
+
+def namespace_declarations(soup):
+    return sorted(
+        (tag.name, attr, value)
+        for tag in soup.find_all(True)
+        for attr, value in tag.attrs.items()
+        if attr.startswith('xmlns')
+    )
+
+
+def namespaced_elements(soup):
+    return [tag.name for tag in soup.find_all(True) if ':' in tag.name]
+
+
+def check_compatibility(html, parser):
+    """
+    Return a list of differences between ``parser`` and html.parser.
+    """
+    cleaned = normalize_html(html)
+    reference = BeautifulSoup(cleaned, REFERENCE_PARSER)
+    candidate = BeautifulSoup(cleaned, parser)
+
+    problems = []
+    for name, extract in (('conditional comments', conditional_comments),
+                          ('namespace declarations', namespace_declarations),
+                          ('namespaced elements', namespaced_elements)):
+        if extract(reference) != extract(candidate):
+            problems.append(f'{name} differ')
+    if transform_html(html, REFERENCE_PARSER) != transform_html(html, parser):
+        problems.append('transformed output differs')
+    return problems
+
+
+def throughput(html, parser, repeat):
+    """
+    Return (parses per second, full transforms per second) for one document.
+    """
+    cleaned = normalize_html(html)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        BeautifulSoup(cleaned, parser)
+    parse_rate = repeat / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        transform_html(html, parser)
+    transform_rate = repeat / (time.perf_counter() - start)
+    return parse_rate, transform_rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare HTML tree builders on email templates.')
+    parser.add_argument('files', nargs='*', default=['new-task.html'], help='HTML files to check')
+    parser.add_argument('--repeat', type=int, default=20, help='Iterations per throughput measurement')
+    args = parser.parse_args()
+
+    failed = False
+    for path in args.files:
+        with open(path, encoding='utf-8') as f:
+            html = f.read()
+        print(f'{path} ({len(html.encode("utf-8")) // 1024} KB)')
+        print(f'  {"parser":<12} {"parse/s":>9} {"transform/s":>12}  compatibility')
+        for name in PARSERS:
+            try:
+                problems = check_compatibility(html, name) if name != REFERENCE_PARSER else []
+                parse_rate, transform_rate = throughput(html, name, args.repeat)
+            except FeatureNotFound:
+                print(f'  {name:<12} not installed')
+                continue
+            failed = failed or bool(problems)
+            print(f'  {name:<12} {parse_rate:>9.1f} {transform_rate:>12.1f}  {"; ".join(problems) or "identical"}')
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
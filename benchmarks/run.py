@@ -0,0 +1,228 @@
+"""
+End-to-end and per-stage throughput benchmark.
+
+Times ``process_html_file`` (and app.py's ``process_html_content`` when
+Streamlit is installed) on every document of a corpus, plus each pipeline
+stage on its own: read, clean, parse, meta tags, each replace_* function,
+the fused single-traversal pass, prettify and write. Results are written to a
+JSON file; ``--compare`` checks a run against an earlier one.
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --corpus ./bench_corpus --compare baseline.json
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import bs4
+from bs4 import BeautifulSoup
+
+from benchmarks.corpus import DEFAULT_LEVELS, DEFAULT_SEED_FILE, build_corpus
+from defaults import DEFAULT_PARSER
+from engine import BODY_TEXT_TAGS, RULESET_VERSION, apply_rules, normalize_html
+from main import (
+    build_pipeline, process_html_file, replace_a_tags, replace_font_family_styles,
+    replace_img_tags, replace_text_content,
+)
+from pipeline import ensure_utf8_meta_tag
+
+QUICK_LEVELS = {
+    'images': [10, 100],
+    'style_blocks': [5, 50],
+    'inline_styles': [100, 1000],
+    'depth': [10, 50],
+    'size': [2],
+}
+
+
+def load_app():
+    """
+    Return app.py's process_html_content, or None if Streamlit is missing.
+    """
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            import app
+    except ImportError:
+        return None
+    return app.process_html_content
+
+
+def time_stages(input_path, output_path, parser):
+    """
+    Run the pipeline one stage at a time and return {stage: seconds}.
+    """
+    timings = {}
+
+    def stage(name, func):
+        start = time.perf_counter()
+        result = func()
+        timings[name] = time.perf_counter() - start
+        return result
+
+    def read():
+        with open(input_path, encoding='utf-8') as f:
+            return f.read()
+
+    def write():
+        with open(output_path, 'w', encoding='utf-8-sig') as f:
+            f.write(output)
+
+    html = stage('read', read)
+    html = stage('clean', lambda: normalize_html(html))
+    soup = stage('parse', lambda: BeautifulSoup(html, parser))
+    stage('ensure_utf8_meta_tag', lambda: ensure_utf8_meta_tag(soup))
+    stage('replace_text_content', lambda: replace_text_content(soup, BODY_TEXT_TAGS, '{{body_text}}'))
+    stage('replace_img_tags', lambda: replace_img_tags(soup))
+    stage('replace_a_tags', lambda: replace_a_tags(soup))
+    stage('replace_font_family_styles', lambda: replace_font_family_styles(soup))
+    output = stage('prettify', lambda: soup.prettify(formatter='html'))
+    stage('write', write)
+
+    # The fused pass replaces the four replace_* stages in process_html_file
+    soup = BeautifulSoup(html, parser)
+    ensure_utf8_meta_tag(soup)
+    stage('apply_rules', lambda: apply_rules(soup, build_pipeline(parser).rules))
+    return timings
+
+
+def time_call(func):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        func()
+    return time.perf_counter() - start
+
+
+def benchmark_document(path, repeat, parser, process_html_content):
+    """
+    Return median end-to-end and per-stage timings for one document.
+    """
+    with tempfile.TemporaryDirectory() as scratch:
+        output_path = os.path.join(scratch, 'out.html')
+        end_to_end = {'process_html_file': [], 'process_html_content': []}
+        stages = {}
+        for _ in range(repeat):
+            end_to_end['process_html_file'].append(
+                time_call(lambda: process_html_file(path, output_path, parser=parser)))
+            if process_html_content is not None:
+                with open(path, encoding='utf-8') as f:
+                    html = f.read()
+                end_to_end['process_html_content'].append(
+                    time_call(lambda: process_html_content(html, parser=parser)))
+            for name, seconds in time_stages(path, output_path, parser).items():
+                stages.setdefault(name, []).append(seconds)
+
+    return {
+        'end_to_end': {name: statistics.median(values) if values else None
+                       for name, values in end_to_end.items()},
+        'stages': {name: statistics.median(values) for name, values in stages.items()},
+    }
+
+
+def corpus_documents(corpus_dir):
+    manifest_path = os.path.join(corpus_dir, 'manifest.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            return json.load(f)
+    return [
+        {'name': os.path.splitext(name)[0], 'file': name, 'params': {},
+         'bytes': os.path.getsize(os.path.join(corpus_dir, name))}
+        for name in sorted(os.listdir(corpus_dir)) if name.lower().endswith('.html')
+    ]
+
+
+def run(corpus_dir, repeat, parser):
+    process_html_content = load_app()
+    results = {
+        'meta': {
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'bs4': bs4.__version__,
+            'parser': parser,
+            'ruleset_version': RULESET_VERSION,
+            'repeat': repeat,
+        },
+        'documents': [],
+    }
+    for entry in corpus_documents(corpus_dir):
+        path = os.path.join(corpus_dir, entry['file'])
+        timings = benchmark_document(path, repeat, parser, process_html_content)
+        results['documents'].append(dict(entry, **timings))
+        seconds = timings['end_to_end']['process_html_file']
+        print(f"{entry['name']:<22} {entry['bytes'] // 1024:>7} KB  {seconds * 1000:>9.1f} ms")
+    return results
+
+
+def compare(baseline, current, threshold, min_delta=0.001):
+    """
+    Print timing ratios against ``baseline`` and return the regressions found.
+    Slowdowns smaller than ``min_delta`` seconds are treated as noise.
+    """
+    regressions = []
+    previous = {doc['name']: doc for doc in baseline['documents']}
+    for doc in current['documents']:
+        old = previous.get(doc['name'])
+        if old is None:
+            continue
+        pairs = [('process_html_file', old['end_to_end'].get('process_html_file'),
+                  doc['end_to_end'].get('process_html_file'))]
+        pairs += [(name, old['stages'].get(name), seconds) for name, seconds in doc['stages'].items()]
+        for name, before, after in pairs:
+            if not before or not after:
+                continue
+            if after / before > 1 + threshold and after - before >= min_delta:
+                regressions.append((doc['name'], name, before, after))
+        e2e = doc['end_to_end']['process_html_file'] / old['end_to_end']['process_html_file']
+        print(f"{doc['name']:<22} process_html_file x{e2e:.2f}")
+
+    for name, stage, before, after in regressions:
+        print(f'REGRESSION {name}/{stage}: {before * 1000:.2f} ms -> {after * 1000:.2f} ms')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the transformer on a synthetic corpus.')
+    parser.add_argument('--corpus', help='Corpus directory (default: generate one from the seed file)')
+    parser.add_argument('--seed-file', default=DEFAULT_SEED_FILE, help='Seed template for a generated corpus')
+    parser.add_argument('--quick', action='store_true', help='Generate a smaller corpus')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per document; medians are reported')
+    parser.add_argument('--parser', default=DEFAULT_PARSER, help='HTML tree builder')
+    parser.add_argument('--output', default='bench_results.json', help='JSON results file')
+    parser.add_argument('--compare', help='Earlier results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Slowdown ratio above which a timing counts as a regression')
+    parser.add_argument('--min-delta', type=float, default=1.0,
+                        help='Ignore slowdowns smaller than this many milliseconds')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as generated:
+        corpus_dir = args.corpus
+        if corpus_dir is None:
+            with open(args.seed_file, encoding='utf-8') as f:
+                seed_html = f.read()
+            corpus_dir = generated
+            build_corpus(corpus_dir, seed_html, QUICK_LEVELS if args.quick else DEFAULT_LEVELS)
+        results = run(corpus_dir, args.repeat, args.parser)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results written to {args.output}')
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(baseline, results, args.threshold, args.min_delta / 1000):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
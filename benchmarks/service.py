@@ -0,0 +1,82 @@
+"""
+Load test for the HTTP transform service.
+
+Opens ``--concurrency`` keep-alive connections to a running service and
+POSTs the given templates to /transform until ``--requests`` have been sent,
+then reports throughput, latency percentiles and the status codes seen
+(429 means the queue was full).
+
+    python service.py --jobs 4 &
+    python -m benchmarks.service new-task.html --concurrency 16 --requests 200
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import sys
+import time
+
+from instrument import percentile
+
+
+async def _post(reader, writer, host, body):
+    writer.write(
+        f'POST /transform HTTP/1.1\r\nHost: {host}\r\nContent-Type: text/html\r\n'
+        f'Content-Length: {len(body)}\r\n\r\n'.encode('latin-1') + body)
+    await writer.drain()
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split(' ')[1])
+    length = next(int(line.split(':', 1)[1]) for line in lines if line.lower().startswith('content-length:'))
+    await reader.readexactly(length)
+    return status
+
+
+async def run(host, port, bodies, concurrency, total):
+    counter = itertools.count()
+    latencies = []
+    statuses = collections.Counter()
+
+    async def client():
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            while next(counter) < total:
+                body = bodies[len(latencies) % len(bodies)]
+                start = time.perf_counter()
+                status = await _post(reader, writer, host, body)
+                latencies.append(time.perf_counter() - start)
+                statuses[status] += 1
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return time.perf_counter() - start, latencies, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test a running transform service.')
+    parser.add_argument('paths', nargs='+', help='HTML templates to send')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--concurrency', '-c', type=int, default=8, help='Concurrent connections')
+    parser.add_argument('--requests', '-n', type=int, default=100, help='Total requests to send')
+    args = parser.parse_args()
+
+    bodies = []
+    for path in args.paths:
+        with open(path, 'rb') as f:
+            bodies.append(f.read())
+
+    elapsed, latencies, statuses = asyncio.run(
+        run(args.host, args.port, bodies, args.concurrency, args.requests))
+    ok = statuses.get(200, 0)
+    print(f'{len(latencies)} requests in {elapsed:.2f} s, {ok / elapsed:.1f} transforms/s')
+    print('status codes: ' + ', '.join(f'{code}: {count}' for code, count in sorted(statuses.items())))
+    print('latency ms: ' + ', '.join(
+        f'p{q} {percentile(latencies, q) * 1000:.1f}' for q in (50, 95, 99)))
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
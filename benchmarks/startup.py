@@ -0,0 +1,101 @@
+"""
+Measure the cold start of the main.py command line against a budget.
+
+Every run starts a fresh interpreter with ``-X importtime`` and reads the
+cumulative import time of ``main`` from its report. The median over
+``--repeat`` runs must stay within ``--budget`` times the median wall time of
+a bare interpreter (``python -c pass``) measured in the same session, so the
+budget scales with the speed of the host. The modules that
+only document processing needs (BeautifulSoup, lxml, the engine, the process
+pool, zipfile/tarfile) must not be loaded by ``import main`` at all. The wall
+time of ``python main.py --help`` is reported next to that of a bare
+interpreter.
+
+    python -m benchmarks.startup [--repeat 10] [--budget 2.5]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# ``import main`` may take this many times as long as starting a bare
+# interpreter. While main.py imported BeautifulSoup at module level it took
+# about 9 times as long; since then it takes 1.5 to 2 times as long
+IMPORT_BUDGET_RATIO = 2.5
+
+DEFERRED_MODULES = ('bs4', 'lxml', 'engine', 'pipeline', 'serializer', 'streaming',
+                    'concurrent.futures.process', 'zipfile', 'tarfile', 'tempfile')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(module='main'):
+    """
+    Import ``module`` in a fresh interpreter and return {imported module:
+    (self us, cumulative us)} from its -X importtime report.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=ROOT, capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(own), int(cumulative))
+    return times
+
+
+def loaded_modules(names, module='main'):
+    """
+    Return the ``names`` that are in sys.modules after importing ``module``.
+    """
+    code = f'import sys, {module}; print(" ".join(n for n in {names!r} if n in sys.modules))'
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return result.stdout.split()
+
+
+def wall_time(args):
+    start = time.perf_counter()
+    subprocess.run([sys.executable] + args, cwd=ROOT, stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the cold start of main.py against a budget.')
+    parser.add_argument('--repeat', type=int, default=10, help='Fresh interpreters to start (default: %(default)s)')
+    parser.add_argument('--budget', type=float, default=IMPORT_BUDGET_RATIO,
+                        help='How many times the startup of a bare interpreter "import main" may take '
+                             '(default: %(default)s)')
+    parser.add_argument('--top', type=int, default=8, help='Slowest imports to list (default: %(default)s)')
+    args = parser.parse_args()
+
+    runs = [import_times() for _ in range(args.repeat)]
+    median = statistics.median(run['main'][1] for run in runs) / 1000
+    bare = statistics.median(wall_time(['-c', 'pass']) for _ in range(args.repeat)) * 1000
+    cli = statistics.median(wall_time(['main.py', '--help']) for _ in range(args.repeat)) * 1000
+
+    budget = bare * args.budget
+    print(f'import main: {median:.1f} ms median of {args.repeat}, {median / bare:.2f}x a bare interpreter '
+          f'(budget {args.budget:g}x = {budget:.0f} ms)')
+    print(f'main.py --help: {cli:.0f} ms wall, bare interpreter {bare:.0f} ms')
+    print('slowest imports (self ms):')
+    last = runs[-1]
+    for name, (own, _) in sorted(last.items(), key=lambda item: -item[1][0])[:args.top]:
+        print(f'  {name:<32} {own / 1000:>6.1f}')
+
+    failed = False
+    if median > budget:
+        print(f'FAIL: import main takes {median:.1f} ms, over the budget of {args.budget:g}x '
+              f'the {bare:.0f} ms bare interpreter startup')
+        failed = True
+    loaded = loaded_modules(DEFERRED_MODULES)
+    if loaded:
+        print(f'FAIL: import main loads {", ".join(loaded)}, which should wait for the first document')
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
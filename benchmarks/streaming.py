@@ -0,0 +1,99 @@
+"""
+Check the streaming engine against the BeautifulSoup engine on a corpus.
+
+The streaming engine tokenizes with html.parser, so it is compared with the
+tree engine running on the html.parser builder. Neither side is prettified and
+both outputs are re-parsed, serialized again and whitespace runs collapsed
+before comparing, so adjacent text nodes, meta charset values and the newline
+bs4 writes after a doctype compare equal. Peak traced memory and wall
+time of both engines are reported alongside.
+
+    python -m benchmarks.streaming new-task.html ./email_templates/
+"""
+import argparse
+import io
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+from bs4 import BeautifulSoup
+
+from engine import apply_rules, normalize_html
+from main import build_pipeline
+from pipeline import ensure_utf8_meta_tag
+from streaming import rewrite_stream
+
+REFERENCE_PARSER = 'html.parser'
+WHITESPACE = re.compile(r'\s+')
+
+
+def iter_html_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith('.html'):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+
+def measure(func):
+    """
+    Return (result, seconds, peak traced bytes) for one call of ``func``.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def tree_html(html):
+    soup = BeautifulSoup(normalize_html(html), REFERENCE_PARSER)
+    ensure_utf8_meta_tag(soup)
+    apply_rules(soup, build_pipeline(REFERENCE_PARSER).rules)
+    return soup.decode(formatter='html')
+
+
+def normalize(html):
+    return WHITESPACE.sub(' ', BeautifulSoup(html, REFERENCE_PARSER).decode(formatter='html'))
+
+
+def stream_html(html):
+    output = io.StringIO()
+    chunks = (html[i:i + 64 * 1024] for i in range(0, len(html), 64 * 1024))
+    rewrite_stream(chunks, output.write, build_pipeline(REFERENCE_PARSER).rules)
+    return output.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the streaming and tree engines.')
+    parser.add_argument('paths', nargs='*', default=['new-task.html'], help='HTML files or directories')
+    args = parser.parse_args()
+
+    mismatches = 0
+    print(f'{"file":<40} {"tree ms":>8} {"tree KiB":>9} {"stream ms":>10} {"stream KiB":>11}  result')
+    for path in iter_html_files(args.paths):
+        with open(path, encoding='utf-8') as f:
+            html = f.read()
+        try:
+            tree, tree_time, tree_peak = measure(lambda: tree_html(html))
+        except Exception as e:
+            print(f'{os.path.basename(path):<40} tree engine failed: {type(e).__name__}: {e}')
+            continue
+        streamed, stream_time, stream_peak = measure(lambda: stream_html(html))
+
+        same = normalize(streamed) == normalize(tree)
+        mismatches += not same
+        print(f'{os.path.basename(path):<40} {tree_time * 1000:>8.1f} {tree_peak / 1024:>9.0f} '
+              f'{stream_time * 1000:>10.1f} {stream_peak / 1024:>11.0f}  {"identical" if same else "DIFFERENT"}')
+
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
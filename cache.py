@@ -0,0 +1,116 @@
+"""
+Content-addressed on-disk cache of transformed templates.
+
+Entries are keyed on a hash of the input bytes, the ruleset version and the
+processing options, so an unchanged template is copied from the cache instead
+of being parsed again. The cache is trimmed to a size limit by evicting the
+least recently used entries.
+"""
+import hashlib
+import json
+import os
+import shutil
+
+
+def default_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.environ.get('EMAIL_TRANSFORMER_CACHE') or os.path.join(base, 'email_transformer')
+
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+class ResultCache:
+    """
+    A directory of transformed outputs named by content hash.
+
+    Instances only hold the directory and size limit, so they can be passed to
+    worker processes.
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+
+    def key(self, data, options):
+        """
+        Return the cache key for input ``data`` (bytes) processed with ``options``.
+        """
+        # Imported here so that the CLI can start without loading the engine
+        from engine import RULESET_VERSION
+
+        digest = hashlib.sha256()
+        digest.update(f'{RULESET_VERSION}\0'.encode())
+        digest.update(json.dumps(options, sort_keys=True).encode())
+        digest.update(b'\0')
+        digest.update(data)
+        return digest.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def fetch(self, key, output_path):
+        """
+        Copy the cached output for ``key`` to ``output_path``.
+        Returns False on a miss.
+        """
+        entry = self._entry_path(key)
+        try:
+            shutil.copyfile(entry, output_path)
+        except FileNotFoundError:
+            return False
+        # Mark the entry as recently used for eviction
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        return True
+
+    def store(self, key, output_path):
+        """
+        Add the file at ``output_path`` to the cache under ``key``.
+        """
+        import tempfile
+
+        entry = self._entry_path(key)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        # Copy to a temporary name first so readers never see a partial entry
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(entry), suffix='.tmp')
+        os.close(fd)
+        try:
+            shutil.copyfile(output_path, temp_path)
+            os.replace(temp_path, entry)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def evict(self):
+        """
+        Delete least recently used entries until the cache fits in
+        ``max_bytes``. Returns the number of entries removed.
+        """
+        entries = []
+        total = 0
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        removed = 0
+        if total <= self.max_bytes:
+            return removed
+        for _, size, path in sorted(entries):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+            if total <= self.max_bytes:
+                break
+        return removed
@@ -0,0 +1,15 @@
+"""
+Option names and defaults shared by the command line, the service and the
+engine.
+
+This module imports nothing, so the CLI can build its argument parser (and
+answer ``--help``) without loading BeautifulSoup and the parser stack.
+"""
+
+# Tree builders that can be passed to BeautifulSoup. lxml is the fastest and
+# keeps MSO conditional comments and VML namespaces intact on email exports.
+PARSERS = ('lxml', 'html.parser')
+DEFAULT_PARSER = 'lxml'
+
+OUTPUT_MODES = ('pretty', 'compact', 'preserve')
+DEFAULT_OUTPUT_MODE = 'pretty'
@@ -0,0 +1,699 @@
+"""
+Single-traversal transformation engine.
+
+Every transformation is expressed as a rule that declares the tag names and/or
+attributes it is interested in. ``apply_rules`` walks the parsed tree exactly
+once and hands each element to the interested rules, in the order the rules
+were given, so a document costs one traversal no matter how many rules run.
+"""
+import re
+import time
+from functools import lru_cache
+from bs4 import NavigableString, Tag
+
+from stylesheet import ClassDimensionIndex, rewrite_stylesheet
+
+# Bump whenever a rule change alters the output, so cached results are not reused
+RULESET_VERSION = 4
+
+BODY_TEXT_TAGS = ['p', 'li', 'span', 'em', 'strong', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6']
+
+FONT_STACK = 'Arial, Helvetica, sans-serif'
+FONT_DECLARATION = 'font-family: ' + FONT_STACK
+BACKGROUND_URL = 'link.com'
+
+# Patterns are compiled once at import; rules only ever call them
+WIDTH_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in [
+    r'width\s*:\s*(\d+)px',      # width: 300px
+    r'width\s*:\s*(\d+)%',       # width: 50%
+    r'width\s*:\s*(\d+)',        # width: 300
+    r'max-width\s*:\s*(\d+)px',  # max-width: 300px
+    r'min-width\s*:\s*(\d+)px'   # min-width: 300px
+]]
+HEIGHT_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in [
+    r'height\s*:\s*(\d+)px',     # height: 200px
+    r'height\s*:\s*(\d+)%',      # height: 50%
+    r'height\s*:\s*(\d+)',       # height: 200
+    r'max-height\s*:\s*(\d+)px', # max-height: 200px
+    r'min-height\s*:\s*(\d+)px'  # min-height: 200px
+]]
+SIZE_CLASS_PATTERN = re.compile(r'(\d+)x(\d+)')
+WIDTH_CLASS_PATTERN = re.compile(r'width-(\d+)')
+HEIGHT_CLASS_PATTERN = re.compile(r'height-(\d+)')
+FONT_FAMILY_PATTERN = re.compile(r'font-family\s*:\s*[^;]+;?', re.IGNORECASE)
+BACKGROUND_URL_PATTERN = re.compile(r'(background(?:-image)?\s*:\s*url\()[\'"]?[^)\'"]+[\'"]?(\))', re.IGNORECASE)
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# Document features a rule can depend on, found by scan_features
+FEATURES = ('images', 'anchors', 'inline_styles', 'style_blocks', 'backgrounds')
+FEATURE_PATTERN = re.compile(r'<(img|a|style)\b|(style)\b|(background)', re.IGNORECASE)
+FEATURE_TAGS = {'img': 'images', 'a': 'anchors', 'style': 'style_blocks'}
+
+# Encoding artifacts removed from text: non-breaking spaces become spaces,
+# zero-width spaces, (non-)joiners and word joiners are dropped
+TEXT_TRANSLATION = str.maketrans({
+    '\xa0': ' ',
+    '\u200b': None,
+    '\u200c': None,
+    '\u200d': None,
+    '\u2060': None,
+})
+
+# Markup that normalize_html leaves untouched: comments (MSO conditionals are
+# comments too), whitespace-sensitive elements and any other tag
+HTML_TOKEN_PATTERN = re.compile(r"""(
+    <!--.*?(?:-->|\Z)
+  | <pre\b.*?(?:</pre\s*>|\Z)
+  | <textarea\b.*?(?:</textarea\s*>|\Z)
+  | <script\b.*?(?:</script\s*>|\Z)
+  | <style\b.*?(?:</style\s*>|\Z)
+  | <[^>]*(?:>|\Z)
+)""", re.IGNORECASE | re.DOTALL | re.VERBOSE)
+
+# Email HTML repeats the same few style="..." values on hundreds of cells, so
+# inline style rewrites are cached on the original value
+INLINE_STYLE_CACHE_SIZE = 4096
+
+
+def clean_text_content(text, collapse_whitespace=True):
+    """
+    Clean text content by removing encoding artifacts and non-breaking spaces.
+    With ``collapse_whitespace=False`` runs of whitespace and the text's
+    leading and trailing whitespace are left as they are.
+    """
+    if not text:
+        return text
+    text = normalize_text(str(text), collapse_whitespace)
+    return text.strip() if collapse_whitespace else text
+
+
+def normalize_text(text, collapse_whitespace=True):
+    """
+    Replace non-breaking spaces with regular spaces, drop zero-width
+    characters and, unless ``collapse_whitespace`` is False, collapse runs of
+    whitespace to one space.
+    """
+    text = text.translate(TEXT_TRANSLATION)
+    if collapse_whitespace:
+        text = WHITESPACE_PATTERN.sub(' ', text)
+    return text
+
+
+def normalize_html(html, collapse_whitespace=True):
+    """
+    Apply normalize_text to the text between the tags of a raw HTML string,
+    in one scan. Tags (and their attribute values), comments (including MSO
+    conditional comments) and the contents of <pre>, <textarea>, <script>
+    and <style> are left exactly as they are. Character references are not
+    decoded, so ``&nbsp;`` spacers survive. With ``collapse_whitespace`` the
+    document's leading and trailing whitespace is stripped too.
+    """
+    pieces = HTML_TOKEN_PATTERN.split(html)
+    normalize_pieces(pieces, collapse_whitespace)
+    html = ''.join(pieces)
+    return html.strip() if collapse_whitespace else html
+
+
+def normalize_pieces(pieces, collapse_whitespace=True, memo=None):
+    """
+    Apply normalize_text in place to the text items (the even ones) of a
+    list split by HTML_TOKEN_PATTERN. Most text runs between tags are the
+    same few indentation strings, so results are memoized in ``memo``.
+    """
+    memo = {} if memo is None else memo
+    for i in range(0, len(pieces), 2):
+        piece = pieces[i]
+        if piece:
+            normalized = memo.get(piece)
+            if normalized is None:
+                normalized = memo[piece] = normalize_text(piece, collapse_whitespace)
+            pieces[i] = normalized
+
+
+def scan_features(html):
+    """
+    Return the set of FEATURES present in an HTML string, found with one
+    regex scan that stops as soon as every feature has been seen. It errs
+    on the side of reporting a feature, e.g. the word "style" in text
+    counts as an inline style.
+    """
+    features = set()
+    for match in FEATURE_PATTERN.finditer(html):
+        tag, style, background = match.groups()
+        if tag:
+            features.add(FEATURE_TAGS[tag.lower()])
+        elif style:
+            features.add('inline_styles')
+        elif background:
+            features.add('backgrounds')
+        if len(features) == len(FEATURES):
+            break
+    return features
+
+
+class Rule:
+    """
+    Base class for a transformation rule.
+
+    ``tags`` lists the tag names the rule visits and ``attrs`` lists attribute
+    names that make any tag carrying them visible to the rule. ``begin``
+    runs once per document before the traversal and returns the object whose
+    ``visit``, ``capture`` and ``finish`` handle that document. ``capture``
+    is called just before ``visit`` when original content is being
+    collected.
+
+    A rule object holds configuration only, so one instance can transform
+    documents in several threads at once. Rules that need per-document state
+    keep it in the object ``begin`` returns.
+
+    ``features`` names the FEATURES of which a document must have at least
+    one for the rule to change anything, or is None if the rule always runs.
+    """
+    tags = ()
+    attrs = ()
+    features = None
+
+    def begin(self, soup):
+        return self
+
+    def capture(self, tag):
+        """
+        Return a list of (child index or None, fields) for the original
+        content ``visit`` is about to replace on ``tag``. The index picks a
+        child node of ``tag``; None means the tag itself.
+        """
+        return []
+
+    def visit(self, tag):
+        raise NotImplementedError
+
+    def finish(self, soup):
+        pass
+
+
+class TextRule(Rule):
+    """
+    Replace the direct text of tags with a placeholder.
+
+    ``placeholders`` maps tag names to the placeholder used for them. A tag that
+    contains only text has it replaced outright; otherwise only its non-blank
+    text nodes are replaced, leaving child elements such as <br> and <span> in
+    place (they are visited on their own).
+    """
+
+    def __init__(self, placeholders):
+        self.placeholders = dict(placeholders)
+        self.tags = tuple(self.placeholders)
+
+    def capture(self, tag):
+        placeholder = self.placeholders[tag.name]
+        return [
+            (index, {'type': 'text', 'placeholder': placeholder, 'text': str(content)})
+            for index, content in enumerate(tag.contents)
+            if isinstance(content, NavigableString) and content.strip()
+        ]
+
+    def visit(self, tag):
+        placeholder = self.placeholders[tag.name]
+        contents = tag.contents
+        if len(contents) == 1 and isinstance(contents[0], NavigableString):
+            if contents[0]:
+                contents[0].replace_with(placeholder)
+            return
+        for content in list(contents):
+            if isinstance(content, NavigableString) and content.strip():
+                content.replace_with(NavigableString(placeholder))
+
+
+class ImageRule(Rule):
+    """
+    Replace img tag attributes with placeholders and placeholder image URLs.
+    Preserves original image dimensions from various sources.
+
+    Images whose size can only come from <style> rules are resolved in
+    ``finish`` against a class index built once from every stylesheet of the
+    document.
+    """
+    tags = ('img', 'style')
+    features = ('images',)
+
+    def __init__(self, alt_placeholder='{{alt_text}}'):
+        self.alt_placeholder = alt_placeholder
+
+    def begin(self, soup):
+        return _ImageDocument(self)
+
+    def size_from_markup(self, img):
+        """
+        Return (width, height, class_names) from the img's attributes, inline
+        style and size-like class names. ``img`` may be a Tag or an attribute
+        dict whose 'class' value is a list.
+        """
+        # 1. Try HTML attributes first
+        width = img.get('width')
+        height = img.get('height')
+
+        # 2. Try inline CSS if attributes not found
+        if not width or not height:
+            style = img.get('style', '')
+            if style:
+                # Try each pattern for width
+                if not width:
+                    for pattern in WIDTH_PATTERNS:
+                        match = pattern.search(style)
+                        if match:
+                            width = match.group(1)
+                            break
+
+                # Try each pattern for height
+                if not height:
+                    for pattern in HEIGHT_PATTERNS:
+                        match = pattern.search(style)
+                        if match:
+                            height = match.group(1)
+                            break
+
+        # 3. Try to extract from CSS classes
+        class_names = []
+        if not width or not height:
+            # Look for common image size classes
+            class_names = img.get('class', [])
+            for class_name in class_names:
+                if 'width' in class_name.lower() or 'size' in class_name.lower():
+                    # Extract numbers from class names like "img-300x200" or "width-300"
+                    size_match = SIZE_CLASS_PATTERN.search(class_name)
+                    if size_match and not width and not height:
+                        width = size_match.group(1)
+                        height = size_match.group(2)
+                        break
+                    # Try single dimension patterns
+                    width_match = WIDTH_CLASS_PATTERN.search(class_name)
+                    if width_match and not width:
+                        width = width_match.group(1)
+                    height_match = HEIGHT_CLASS_PATTERN.search(class_name)
+                    if height_match and not height:
+                        height = height_match.group(1)
+
+        return width, height, class_names
+
+    def apply_placeholder(self, img, width, height):
+        """
+        Set the placeholder src, alt and title on ``img`` (a Tag or attribute
+        dict), falling back to sensible dimensions where they are unknown.
+        """
+        # 4. Smart fallbacks based on common email image sizes
+        if not width:
+            # Common email image widths
+            width = '600'  # Standard email width
+        if not height:
+            # Use width as height to make square images when height is unknown
+            if width and width.isdigit():
+                height = width  # Make it square
+            else:
+                height = '600'  # Default square size
+
+        # Ensure dimensions are valid numbers
+        try:
+            width_int = int(width)
+            height_int = int(height)
+            # Set reasonable limits
+            width_int = max(50, min(width_int, 1200))
+            height_int = max(50, min(height_int, 800))
+            width = str(width_int)
+            height = str(height_int)
+        except (ValueError, TypeError):
+            width = '600'
+            height = '300'
+
+        # Replace attributes with a reliable placeholder service
+        img['src'] = f'https://placehold.jp/ffffff/{width}x{height}.png'
+        img['alt'] = self.alt_placeholder
+        img['title'] = self.alt_placeholder
+
+        # Preserve original width/height attributes if they existed
+        if not img.get('width'):
+            img['width'] = width
+        if not img.get('height'):
+            img['height'] = height
+
+
+class _ImageDocument:
+    """
+    ImageRule's state for one document: the stylesheets seen so far, the
+    images waiting for them and the captured fields ``finish`` completes.
+    """
+
+    def __init__(self, rule):
+        self.rule = rule
+        self.stylesheets = []
+        self.pending = []
+        self.captured = {}
+
+    def visit(self, tag):
+        if tag.name == 'style':
+            if tag.string:
+                self.stylesheets.append(str(tag.string))
+            return
+
+        width, height, class_names = self.rule.size_from_markup(tag)
+        if (not width or not height) and class_names:
+            self.pending.append((tag, width, height, class_names))
+        else:
+            self.rule.apply_placeholder(tag, width, height)
+
+    def capture(self, tag):
+        if tag.name != 'img':
+            return []
+        width, height, _ = self.rule.size_from_markup(tag)
+        fields = {
+            'type': 'image', 'placeholder': self.rule.alt_placeholder, 'src': tag.get('src'),
+            'alt': tag.get('alt'), 'title': tag.get('title'), 'width': width, 'height': height,
+        }
+        # Dimensions that only a <style> rule declares are filled in by finish
+        self.captured[id(tag)] = fields
+        return [(None, fields)]
+
+    def finish(self, soup):
+        if self.pending:
+            # If still no dimensions, look the classes up in the document's CSS rules
+            index = ClassDimensionIndex(self.stylesheets)
+            for img, width, height, class_names in self.pending:
+                width, height = index.lookup(class_names, width, height)
+                if id(img) in self.captured:
+                    self.captured[id(img)].update(width=width, height=height)
+                self.rule.apply_placeholder(img, width, height)
+
+
+class AnchorRule(Rule):
+    """
+    Replace href attributes in anchor tags and text content.
+    """
+    tags = ('a',)
+    features = ('anchors',)
+
+    def __init__(self, href_placeholder, text_placeholder='{{body_text}}'):
+        self.href_placeholder = href_placeholder
+        self.text_placeholder = text_placeholder
+
+    def capture(self, a):
+        entries = [(None, {'type': 'link', 'placeholder': self.href_placeholder, 'href': a.get('href')})]
+        for index, content in enumerate(a.contents):
+            if isinstance(content, NavigableString) and clean_text_content(content):
+                entries.append((index, {'type': 'link_text', 'placeholder': self.text_placeholder,
+                                        'text': str(content)}))
+        return entries
+
+    def visit(self, a):
+        a['href'] = self.href_placeholder
+
+        # Replace text content with placeholder
+        for content in list(a.contents):
+            if isinstance(content, NavigableString) and content.strip():
+                # Clean the text content and replace with placeholder
+                if clean_text_content(content):
+                    content.replace_with(NavigableString(self.text_placeholder))
+                else:
+                    content.extract()
+
+
+@lru_cache(maxsize=INLINE_STYLE_CACHE_SIZE)
+def _rewrite_inline_font_family(style):
+    # Replace any existing font-family declarations
+    updated_style = FONT_FAMILY_PATTERN.sub(FONT_DECLARATION + ';', style)
+
+    # If no font-family was found, append it safely
+    if 'font-family' not in updated_style.lower():
+        updated_style = updated_style.strip()
+        # Ensure a semicolon before appending
+        if not updated_style.endswith(';') and updated_style != '':
+            updated_style += ';'
+        updated_style += ' ' + FONT_DECLARATION + ';'
+
+    return updated_style.strip()
+
+
+@lru_cache(maxsize=INLINE_STYLE_CACHE_SIZE)
+def _rewrite_inline_background(style):
+    return BACKGROUND_URL_PATTERN.sub(r'\1' + BACKGROUND_URL + r'\2', style).strip()
+
+
+INLINE_STYLE_CACHES = (_rewrite_inline_font_family, _rewrite_inline_background)
+
+
+def inline_style_cache_counts():
+    """
+    Return the (hits, misses) of this process's inline style caches so far.
+    """
+    infos = [cache.cache_info() for cache in INLINE_STYLE_CACHES]
+    return sum(info.hits for info in infos), sum(info.misses for info in infos)
+
+
+def record_inline_style_counts(timer, since):
+    """
+    Add the inline style cache hits and misses since ``since`` (a result of
+    inline_style_cache_counts) to ``timer``'s counters.
+    """
+    hits, misses = inline_style_cache_counts()
+    timer.count('inline_style_hits', hits - since[0])
+    timer.count('inline_style_misses', misses - since[1])
+
+
+class FontFamilyRule(Rule):
+    """
+    Replace all font-family styles with Arial, Helvetica, sans-serif,
+    avoiding duplicate semicolons or broken CSS syntax.
+
+    With ``stylesheets=False`` only inline style attributes are rewritten,
+    for use with a StylesheetRule (see fuse_stylesheet_rules).
+    """
+    tags = ('style',)
+    attrs = ('style',)
+    features = ('inline_styles', 'style_blocks')
+    stylesheet_options = {'font_family': FONT_STACK}
+
+    def __init__(self, stylesheets=True):
+        self.stylesheets = stylesheets
+        if not stylesheets:
+            self.tags = ()
+
+    def visit(self, tag):
+        # Handle inline style attributes
+        if 'style' in tag.attrs:
+            tag['style'] = self.rewrite_style(tag['style'])
+
+        # Handle <style> tags with actual CSS code inside
+        if tag.name == 'style' and tag.string:
+            tag.string.replace_with(self.rewrite_css(tag.string))
+
+    def rewrite_style(self, style):
+        """
+        Rewrite an inline style attribute value. Results are cached.
+        """
+        return _rewrite_inline_font_family(style)
+
+    def rewrite_css(self, css):
+        """
+        Rewrite the contents of a <style> block (see stylesheet.rewrite_stylesheet).
+        """
+        return rewrite_stylesheet(css, **self.stylesheet_options)
+
+
+class BackgroundImageRule(Rule):
+    """
+    Replace all background image URLs (both inline styles and internal <style> tags) with link.com
+
+    With ``stylesheets=False`` only inline style attributes are rewritten,
+    for use with a StylesheetRule (see fuse_stylesheet_rules).
+    """
+    tags = ('style',)
+    attrs = ('style',)
+    features = ('backgrounds',)
+    stylesheet_options = {'background_url': BACKGROUND_URL}
+
+    def __init__(self, stylesheets=True):
+        self.stylesheets = stylesheets
+        if not stylesheets:
+            self.tags = ()
+
+    def visit(self, tag):
+        # 1. Handle inline style attributes
+        if 'style' in tag.attrs:
+            tag['style'] = self.rewrite_style(tag['style'])
+
+        # 2. Handle <style> tags with internal CSS
+        if tag.name == 'style' and tag.string:
+            tag.string.replace_with(self.rewrite_css(tag.string))
+
+    def rewrite_style(self, style):
+        """
+        Replace background-image:url(...) or background:url(...) in an inline
+        style attribute value. Results are cached.
+        """
+        return _rewrite_inline_background(style)
+
+    def rewrite_css(self, css):
+        """
+        Rewrite the contents of a <style> block (see stylesheet.rewrite_stylesheet).
+        """
+        return rewrite_stylesheet(css, **self.stylesheet_options)
+
+
+class StylesheetRule(Rule):
+    """
+    Rewrite <style> blocks for several CSS rules in one pass over each
+    stylesheet. ``options`` are passed on to stylesheet.rewrite_stylesheet.
+    """
+    tags = ('style',)
+    features = ('style_blocks',)
+
+    def __init__(self, **options):
+        self.options = options
+
+    def visit(self, tag):
+        if tag.string:
+            tag.string.replace_with(self.rewrite_css(tag.string))
+
+    def rewrite_css(self, css):
+        return rewrite_stylesheet(css, **self.options)
+
+
+def fuse_stylesheet_rules(rules):
+    """
+    Return ``rules`` with the <style> block rewriting of every
+    FontFamilyRule and BackgroundImageRule done by one StylesheetRule, placed
+    where the first of them was. The rules keep rewriting inline styles.
+    With fewer than two such rules, ``rules`` is returned as it is.
+    """
+    fusable = [rule for rule in rules
+               if isinstance(rule, (FontFamilyRule, BackgroundImageRule)) and rule.stylesheets]
+    if len(fusable) < 2:
+        return list(rules)
+    options = {}
+    for rule in fusable:
+        options.update(rule.stylesheet_options)
+    fused = []
+    for rule in rules:
+        if rule in fusable:
+            if rule is fusable[0]:
+                fused.append(StylesheetRule(**options))
+            rule = type(rule)(stylesheets=False)
+        fused.append(rule)
+    return fused
+
+
+class _TimedRule:
+    """
+    Wraps a rule for one apply_rules call to accumulate the time spent in
+    it and the tags it visits.
+    """
+
+    def __init__(self, rule):
+        self.rule = rule
+        self.tags = rule.tags
+        self.attrs = rule.attrs
+        self.features = rule.features
+        self.seconds = 0.0
+        self.nodes = 0
+
+    def _timed(self, method, arg):
+        start = time.perf_counter()
+        method(arg)
+        self.seconds += time.perf_counter() - start
+
+    def begin(self, soup):
+        start = time.perf_counter()
+        self.document = self.rule.begin(soup)
+        self.seconds += time.perf_counter() - start
+        return self
+
+    def visit(self, tag):
+        self.nodes += 1
+        self._timed(self.document.visit, tag)
+
+    def capture(self, tag):
+        return self.document.capture(tag)
+
+    def finish(self, soup):
+        self._timed(self.document.finish, soup)
+
+
+def node_path(tag, paths=None):
+    """
+    Return an XPath-like path to ``tag``, e.g. /html[1]/body[1]/table[2].
+    Positions count earlier siblings with the same name, from 1. ``paths``
+    may be a dict used to memoize the paths of ancestors.
+    """
+    if tag is None or tag.name == '[document]':
+        return ''
+    if paths is not None and id(tag) in paths:
+        return paths[id(tag)]
+    position = 1
+    for sibling in tag.previous_siblings:
+        if isinstance(sibling, Tag) and sibling.name == tag.name:
+            position += 1
+    path = f'{node_path(tag.parent, paths)}/{tag.name}[{position}]'
+    if paths is not None:
+        paths[id(tag)] = path
+    return path
+
+
+def apply_rules(soup, rules, timer=None, originals=None):
+    """
+    Walk the tree once and dispatch every tag to the rules interested in it.
+
+    Rules see a tag in the order they are listed, so a list of rules behaves
+    like running each rule over the whole document one after another.
+
+    ``timer`` (an instrument.StageTimer) receives the time spent in each rule
+    and the number of tags it visited, under the rule's class name, plus the
+    number of tags walked under 'rules' and the inline style cache hits and
+    misses as counters.
+
+    With a list as ``originals``, the content each rule replaces is appended
+    to it first, as dicts with the fields from Rule.capture and the node's
+    'path' (see node_path; a child node adds ``/node()[n]``).
+    """
+    paths = {}
+    if timer is not None:
+        rules = [_TimedRule(rule) for rule in rules]
+        cache_counts = inline_style_cache_counts()
+    watched_attrs = tuple(sorted({attr for rule in rules for attr in rule.attrs}))
+    dispatch = {}
+    walked = 0
+
+    # Per-document handlers, so that the rule objects themselves stay unchanged
+    documents = [rule.begin(soup) for rule in rules]
+
+    stack = [child for child in reversed(soup.contents) if isinstance(child, Tag)]
+    while stack:
+        tag = stack.pop()
+        walked += 1
+
+        key = (tag.name, tuple(attr for attr in watched_attrs if attr in tag.attrs))
+        interested = dispatch.get(key)
+        if interested is None:
+            interested = dispatch[key] = tuple(
+                document for rule, document in zip(rules, documents)
+                if tag.name in rule.tags or any(attr in key[1] for attr in rule.attrs)
+            )
+        for document in interested:
+            if originals is not None:
+                for index, fields in document.capture(tag):
+                    path = node_path(tag, paths)
+                    if index is not None:
+                        path += f'/node()[{index + 1}]'
+                    # Filled in place, so a rule may complete the fields in finish
+                    fields['path'] = path
+                    originals.append(fields)
+            document.visit(tag)
+
+        stack.extend(child for child in reversed(tag.contents) if isinstance(child, Tag))
+
+    for document in documents:
+        document.finish(soup)
+
+    if timer is not None:
+        record_inline_style_counts(timer, cache_counts)
+        timer.add('rules', 0.0, walked)
+        for rule in rules:
+            timer.add(type(rule.rule).__name__, rule.seconds, rule.nodes)
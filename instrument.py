@@ -0,0 +1,204 @@
+"""
+Per-stage instrumentation for transform runs.
+
+Every processed document produces a record of the wall time and node count of
+each stage (read, parse, every rule, serialize, ...). A run's records are
+summarised into p50/p95/p99 latencies per stage and written as a JSON or CSV
+report, and the slowest documents can be re-run under cProfile.
+"""
+import array
+import heapq
+import itertools
+import json
+import math
+import os
+import re
+import time
+from contextlib import contextmanager
+
+
+# Characters kept in profile file names; the rest are not portable
+UNSAFE_NAME_CHARACTERS = re.compile(r'[^A-Za-z0-9._-]')
+
+
+class StageTimer:
+    """
+    Collects {stage: {'seconds', 'nodes'}} and {counter: count} for one
+    document.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds, nodes=None):
+        entry = self.stages.setdefault(name, {'seconds': 0.0, 'nodes': None})
+        entry['seconds'] += seconds
+        if nodes is not None:
+            entry['nodes'] = (entry['nodes'] or 0) + nodes
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+
+def percentile(values, q):
+    """
+    Return the ``q``-th percentile (0-100) of ``values`` by linear interpolation.
+    """
+    values = sorted(values)
+    if not values:
+        return None
+    position = (len(values) - 1) * q / 100
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class RunReport:
+    """
+    Accumulates the records of a run in bounded memory: per-stage timing
+    samples, counter totals, the ``keep`` slowest successfully transformed
+    documents and every failed one.
+    """
+
+    def __init__(self, keep=100):
+        self.keep = keep
+        self.samples = {}
+        self.nodes = {}
+        self.counters = {}
+        self.slowest = []
+        self.failures = []
+        self.succeeded = 0
+        self._sequence = itertools.count()
+
+    def add(self, record):
+        if record['status'] == 'failed':
+            self.failures.append(record)
+            return
+        self.succeeded += 1
+        for name, n in record.get('counters', {}).items():
+            self.counters[name] = self.counters.get(name, 0) + n
+        self._sample('document', record['seconds'])
+        for name, entry in record['stages'].items():
+            self._sample(name, entry['seconds'])
+            if entry['nodes'] is not None:
+                self.nodes[name] = self.nodes.get(name, 0) + entry['nodes']
+        if record['status'] == 'ok' and self.keep:
+            item = (record['seconds'], next(self._sequence), record)
+            if len(self.slowest) < self.keep:
+                heapq.heappush(self.slowest, item)
+            else:
+                heapq.heappushpop(self.slowest, item)
+
+    def _sample(self, name, seconds):
+        samples = self.samples.get(name)
+        if samples is None:
+            samples = self.samples[name] = array.array('d')
+        samples.append(seconds)
+
+    @property
+    def failed(self):
+        return len(self.failures)
+
+    def __len__(self):
+        return self.succeeded + self.failed
+
+    def slowest_records(self):
+        """
+        Return the kept successful records, slowest first.
+        """
+        return [record for _, _, record in sorted(self.slowest, reverse=True)]
+
+    def summary(self):
+        """
+        Return {stage: {count, total, p50, p95, p99, nodes}}, with the
+        document totals under 'document'. Failed documents are left out.
+        """
+        return {
+            name: {
+                'count': len(values),
+                'total': sum(values),
+                'p50': percentile(values, 50),
+                'p95': percentile(values, 95),
+                'p99': percentile(values, 99),
+                'nodes': self.nodes.get(name),
+            }
+            for name, values in self.samples.items() if values
+        }
+
+
+def write_report(path, report):
+    """
+    Write a RunReport to ``path``: the per-stage summary, the counter totals
+    and the records of the slowest and the failed documents as JSON, or the
+    per-stage summary as CSV if ``path`` ends in .csv.
+    """
+    summary = report.summary()
+    if path.lower().endswith('.csv'):
+        import csv
+
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['stage', 'count', 'total_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'nodes'])
+            for name, row in summary.items():
+                writer.writerow([name, row['count']]
+                                + [f"{row[key] * 1000:.3f}" for key in ('total', 'p50', 'p95', 'p99')]
+                                + [row['nodes'] if row['nodes'] is not None else ''])
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            documents = report.slowest_records() + report.failures
+            json.dump({'summary': summary, 'counters': report.counters, 'documents': documents}, f, indent=2)
+
+
+def format_summary(summary):
+    """
+    Return the per-stage summary as a text table, slowest stage first.
+    """
+    lines = [f"{'stage':<24} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'nodes':>9}"]
+    for name, row in sorted(summary.items(), key=lambda item: -item[1]['total']):
+        nodes = row['nodes'] if row['nodes'] is not None else '-'
+        lines.append(f"{name:<24} {row['count']:>6} {row['p50'] * 1000:>9.1f} "
+                     f"{row['p95'] * 1000:>9.1f} {row['p99'] * 1000:>9.1f} {nodes:>9}")
+    return '\n'.join(lines)
+
+
+def profile_name(record):
+    """
+    Return a file name stem for a record's profile: the archive member's
+    path inside its archive, the file's path relative to the input directory
+    of a directory run, or else the input file's name, without the extension
+    and with every character other than letters, digits, '.', '-' and '_'
+    (such as path separators and ':') replaced by '_'.
+    """
+    name = record.get('member') or record.get('relative') or os.path.basename(record['input'])
+    return UNSAFE_NAME_CHARACTERS.sub('_', os.path.splitext(name)[0])
+
+
+def profile_slowest(report, directory, top, run):
+    """
+    Re-run the ``top`` slowest successful documents under cProfile and write
+    one .prof file per document into ``directory``.
+
+    ``run(record)`` processes the document a record describes again.
+    Returns the paths written.
+    """
+    import cProfile
+
+    os.makedirs(directory, exist_ok=True)
+    slowest = report.slowest_records()[:top]
+    written = []
+    for rank, record in enumerate(slowest, 1):
+        path = os.path.join(directory, f'{rank:02d}-{profile_name(record)}.prof')
+        profiler = cProfile.Profile()
+        profiler.runcall(run, record)
+        profiler.dump_stats(path)
+        written.append(path)
+    return written
@@ -1,319 +1,568 @@
+import collections
+import contextlib
+import io
+import json
 import os
-import re
-from bs4 import BeautifulSoup, NavigableString
+import sys
+import time
+from functools import lru_cache
 
-def clean_text_content(text):
-    if not text:
-        return text
-    
-    # Convert to string if it's not already
-    text = str(text)
-    
-    # Replace non-breaking spaces with regular spaces
-    text = text.replace('\xa0', ' ')
-    
-    # Remove other common encoding artifacts
-    text = text.replace('\u00a0', ' ')  # Another form of non-breaking space
-    text = text.replace('\u200b', '')   # Zero-width space
-    text = text.replace('\u200c', '')   # Zero-width non-joiner
-    text = text.replace('\u200d', '')   # Zero-width joiner
-    text = text.replace('\u2060', '')   # Word joiner
-    
-    # Clean up multiple spaces
-    text = re.sub(r'\s+', ' ', text)
-    
-    return text.strip()
+# BeautifulSoup, the engine and the process pool are imported by the
+# functions that use them, so that --help, argument errors and the first
+# byte of a single-file run do not wait for them (see benchmarks/startup.py)
+from archive import archive_format, templated_archive_name
+from batch import DEFAULT_EXCLUDE, DEFAULT_INCLUDE, JOURNAL_NAME, Journal, iter_templates
+from cache import DEFAULT_MAX_BYTES, ResultCache, default_cache_dir
+from defaults import DEFAULT_OUTPUT_MODE, DEFAULT_PARSER, OUTPUT_MODES, PARSERS
+from instrument import RunReport, StageTimer, format_summary, profile_slowest, write_report
+from reader import open_source
+from shards import MANIFEST_PREFIX, ShardManifest, manifest_path, merge_manifests, parse_shard, shard_name, shard_of
+from skeletons import DEFAULT_SIMILARITY, MANIFEST_NAME, SkeletonStore
+from watch import snapshot, watch_directory
 
-def ensure_utf8_meta_tag(soup):
-    """
-    Ensure the HTML has proper UTF-8 meta tag in the head.
-    """
-    head = soup.find('head')
-    if not head:
-        # Create head tag if it doesn't exist
-        head = soup.new_tag('head')
-        soup.html.insert(0, head)
-    
-    # Check if charset meta tag already exists
-    charset_meta = head.find('meta', charset=True)
-    if charset_meta:
-        charset_meta['charset'] = 'UTF-8'
-    else:
-        # Create new charset meta tag
-        meta_charset = soup.new_tag('meta', charset='UTF-8')
-        head.insert(0, meta_charset)
-    
-    # Also add content-type meta tag for better compatibility
-    content_meta = head.find('meta', attrs={'http-equiv': 'Content-Type'})
-    if not content_meta:
-        meta_content = soup.new_tag('meta', http_equiv='Content-Type', content='text/html; charset=UTF-8')
-        head.insert(1, meta_content)
+ENGINES = ('tree', 'stream')
 
 def replace_text_content(soup, tags, placeholder):
-    for tag in soup.find_all(tags):
-        if tag.string and not tag.find(True):
-            tag.string.replace_with(placeholder)
-        else:
-            new_contents = []
-            for content in tag.contents:
-                if isinstance(content, NavigableString) and content.strip():
-                    new_contents.append(NavigableString(placeholder))
-                else:
-                    new_contents.append(content)
-            tag.clear()
-            for content in new_contents:
-                tag.append(content)
+    from engine import TextRule, apply_rules
+    apply_rules(soup, [TextRule(dict.fromkeys(tags, placeholder))])
 
 def replace_img_tags(soup):
-    for img in soup.find_all('img'):
-        # Extract width and height from multiple sources
-        width = None
-        height = None
-        
-        # 1. Try HTML attributes first
-        width = img.get('width')
-        height = img.get('height')
-        
-        # 2. Try inline CSS if attributes not found
-        if not width or not height:
-            style = img.get('style', '')
-            if style:
-                # Look for width/height in various formats
-                width_patterns = [
-                    r'width\s*:\s*(\d+)px',      # width: 300px
-                    r'width\s*:\s*(\d+)%',       # width: 50%
-                    r'width\s*:\s*(\d+)',        # width: 300
-                    r'max-width\s*:\s*(\d+)px',  # max-width: 300px
-                    r'min-width\s*:\s*(\d+)px'   # min-width: 300px
-                ]
-                height_patterns = [
-                    r'height\s*:\s*(\d+)px',     # height: 200px
-                    r'height\s*:\s*(\d+)%',      # height: 50%
-                    r'height\s*:\s*(\d+)',       # height: 200
-                    r'max-height\s*:\s*(\d+)px', # max-height: 200px
-                    r'min-height\s*:\s*(\d+)px'  # min-height: 200px
-                ]
-                
-                # Try each pattern for width
-                if not width:
-                    for pattern in width_patterns:
-                        match = re.search(pattern, style, re.IGNORECASE)
-                        if match:
-                            width = match.group(1)
-                            break
-                
-                # Try each pattern for height
-                if not height:
-                    for pattern in height_patterns:
-                        match = re.search(pattern, style, re.IGNORECASE)
-                        if match:
-                            height = match.group(1)
-                            break
-        
-        # 3. Try to extract from CSS classes and style rules
-        if not width or not height:
-            # Look for common image size classes
-            class_names = img.get('class', [])
-            for class_name in class_names:
-                if 'width' in class_name.lower() or 'size' in class_name.lower():
-                    # Extract numbers from class names like "img-300x200" or "width-300"
-                    size_match = re.search(r'(\d+)x(\d+)', class_name)
-                    if size_match and not width and not height:
-                        width = size_match.group(1)
-                        height = size_match.group(2)
-                        break
-                    # Try single dimension patterns
-                    width_match = re.search(r'width-(\d+)', class_name)
-                    if width_match and not width:
-                        width = width_match.group(1)
-                    height_match = re.search(r'height-(\d+)', class_name)
-                    if height_match and not height:
-                        height = height_match.group(1)
-            
-            # If still no dimensions, try to find CSS rules for the classes
-            if (not width or not height) and class_names:
-                for style_tag in soup.find_all('style'):
-                    if style_tag.string:
-                        css_content = style_tag.string
-                        for class_name in class_names:
-                            # Look for CSS rules for this class
-                            class_pattern = rf'\.{re.escape(class_name)}\s*{{[^}}]*}}'
-                            class_match = re.search(class_pattern, css_content, re.DOTALL)
-                            if class_match:
-                                rule_content = class_match.group(0)
-                                # Extract width/height from the CSS rule
-                                if not width:
-                                    width_match = re.search(r'width\s*:\s*(\d+)px', rule_content)
-                                    if width_match:
-                                        width = width_match.group(1)
-                                if not height:
-                                    height_match = re.search(r'height\s*:\s*(\d+)px', rule_content)
-                                    if height_match:
-                                        height = height_match.group(1)
-        
-        # 4. Smart fallbacks based on common email image sizes
-        if not width:
-            # Common email image widths
-            width = '600'  # Standard email width
-        if not height:
-            # Use width as height to make square images when height is unknown
-            if width and width.isdigit():
-                height = width  # Make it square
-            else:
-                height = '600'  # Default square size
-        
-        # Ensure dimensions are valid numbers
-        try:
-            width_int = int(width)
-            height_int = int(height)
-            # Set reasonable limits
-            width_int = max(50, min(width_int, 1200))
-            height_int = max(50, min(height_int, 800))
-            width = str(width_int)
-            height = str(height_int)
-        except (ValueError, TypeError):
-            width = '600'
-            height = '300'
-        
-        # Replace attributes with a reliable placeholder service
-        img['src'] = f'https://placehold.jp/ffffff/{width}x{height}.png'
-        img['alt'] = '{{alt_text}}'
-        img['title'] = '{{alt_text}}'
-        
-        # Preserve original width/height attributes if they existed
-        if not img.get('width'):
-            img['width'] = width
-        if not img.get('height'):
-            img['height'] = height
+    from engine import ImageRule, apply_rules
+    apply_rules(soup, [ImageRule()])
 
 def replace_a_tags(soup):
     """
     Replace href attributes in anchor tags and text content.
     """
-    for a in soup.find_all('a'):
-        a['href'] = '{{product_image_url}}'
-        
-        # Replace text content with placeholder
-        new_contents = []
-        for content in a.contents:
-            if isinstance(content, NavigableString) and content.strip():
-                # Clean the text content and replace with placeholder
-                cleaned_text = clean_text_content(content)
-                if cleaned_text:
-                    new_contents.append(NavigableString('{{body_text}}'))
-            else:
-                new_contents.append(content)
-        
-        a.clear()
-        for content in new_contents:
-            a.append(content)
-
-import re
-from bs4 import BeautifulSoup
+    from engine import AnchorRule, apply_rules
+    apply_rules(soup, [AnchorRule('{{product_image_url}}')])
 
 def replace_font_family_styles(soup):
     """
     Replace all font-family styles with Arial, Helvetica, sans-serif,
     avoiding duplicate semicolons or broken CSS syntax.
     """
-    font_declaration = 'font-family: Arial, Helvetica, sans-serif'
+    from engine import FontFamilyRule, apply_rules
+    apply_rules(soup, [FontFamilyRule()])
+
+@lru_cache(maxsize=None)
+def build_pipeline(parser=DEFAULT_PARSER, output=DEFAULT_OUTPUT_MODE):
+    """
+    Return the pipeline used by process_html_file. Pipelines are built once
+    per parser and output mode and reused for every document processed by
+    this process.
+    """
+    from pipeline import TransformPipeline
+    return TransformPipeline(href_placeholder='{{product_image_url}}', parser=parser, output=output)
+
+def transform_html(html, parser=DEFAULT_PARSER, timer=None):
+    """
+    Apply the transformation rules to an HTML string and return the result.
+    Stage timings are recorded on ``timer`` (an instrument.StageTimer) if given.
+    """
+    return build_pipeline(parser).transform_html(html, timer)
+
+def process_html_file(input_path, output_path, parser=DEFAULT_PARSER, engine='tree', cache=None,
+                      output=DEFAULT_OUTPUT_MODE, originals=False):
+    """
+    Process a single HTML file according to the transformation rules.
+    ``parser`` names the BeautifulSoup tree builder to use (see PARSERS).
+    ``engine='stream'`` rewrites the file token by token without building a
+    tree; its output is never prettified. ``output`` selects the tree
+    engine's output mode (see serializer.OUTPUT_MODES). With a ResultCache as
+    ``cache``, an input that was processed before with the same options is
+    copied from the cache instead. With ``originals``, the replaced text,
+    URLs and image details are also written to a JSONL sidecar next to the
+    output (see originals_path); the cache is not used then.
+
+    Returns the document's record: status ('ok' or 'cached'), encoding,
+    size, SHA-256 of the input, total seconds and the wall time and node
+    count of every stage.
+    """
+    import hashlib
+    
+    pipeline = build_pipeline(parser, output)
+    timer = StageTimer()
+    start = time.perf_counter()
+    record = {
+        'input': input_path, 'output': output_path, 'status': 'ok', 'error': None,
+        'encoding': None, 'bytes': None, 'sha256': None, 'seconds': None, 'stages': timer.stages,
+        'counters': timer.counters,
+    }
+    
+    # The file is read once; its bytes feed the cache key and the decoder
+    with open_source(input_path) as data:
+        timer.add('read', time.perf_counter() - start)
+        record['bytes'] = len(data)
+        record['sha256'] = hashlib.sha256(data).hexdigest()
+        
+        if originals:
+            cache = None
+        if cache is not None:
+            with timer.stage('cache_lookup'):
+                cache_key = cache.key(data, {'parser': parser, 'engine': engine, 'output': output})
+                hit = cache.fetch(cache_key, output_path)
+            if hit:
+                record['status'] = 'cached'
+                record['seconds'] = time.perf_counter() - start
+                return record
+        
+        if engine == 'stream':
+            from engine import inline_style_cache_counts, record_inline_style_counts
+            from streaming import rewrite_bytes
+            cache_counts = inline_style_cache_counts()
+            with timer.stage('stream'), replaced_on_success(output_path) as temp_path:
+                record['encoding'] = rewrite_bytes(data, temp_path, pipeline.rules)
+            record_inline_style_counts(timer, cache_counts)
+        else:
+            record['encoding'] = _transform_file(data, output_path, pipeline, timer, originals)
+    
+    if cache is not None:
+        with timer.stage('cache_store'):
+            cache.store(cache_key, output_path)
+    
+    record['seconds'] = time.perf_counter() - start
+    return record
+
+def _transform_file(data, output_path, pipeline, timer, originals=False):
+    
+    # Decode once, with the encoding sniffed from a BOM or <meta> charset
+    with timer.stage('decode'):
+        html, encoding = pipeline.decode(data)
+    
+    # Write the transformed HTML with proper UTF-8 encoding and BOM, via a
+    # temporary file so that a failed transform leaves no partial output
+    captured = [] if originals else None
+    with replaced_on_success(output_path) as temp_path:
+        with open(temp_path, 'w', encoding='utf-8-sig') as f:
+            pipeline.write_html(html, f, timer, captured)
+    
+    if originals:
+        with timer.stage('originals'):
+            with open(originals_path(output_path), 'wb') as f:
+                f.write(originals_jsonl(captured))
+    return encoding
+
+def originals_path(output_path):
+    """
+    Return the path of the original-content sidecar for an output file:
+    email_templated.html -> email_templated.originals.jsonl.
+    """
+    return os.path.splitext(output_path)[0] + '.originals.jsonl'
 
-    # Handle inline style attributes
-    for tag in soup.find_all(style=True):
-        style = tag['style']
+def originals_jsonl(originals):
+    """
+    Return captured original content (see engine.apply_rules) as JSONL bytes.
+    """
+    return ''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in originals).encode('utf-8')
 
-        # Replace any existing font-family declarations
-        updated_style = re.sub(
-            r'font-family\s*:\s*[^;]+;?',
-            font_declaration + ';',
-            style,
-            flags=re.IGNORECASE
-        )
+def describe(record):
+    """
+    Return the one-line console message for a document record.
+    """
+    if record['status'] == 'failed':
+        return f"Failed to process {record['input']}: {record['error']}"
+    if record['status'] == 'cached':
+        return f"Cache hit: {record['input']} -> {record['output']}"
+    return (f"Processed: {record['input']} -> {record['output']} "
+            f"({record['seconds'] * 1000:.0f} ms, {record['encoding']})")
 
-        # If no font-family was found, append it safely
-        if 'font-family' not in updated_style.lower():
-            updated_style = updated_style.strip()
-            # Ensure a semicolon before appending
-            if not updated_style.endswith(';') and updated_style != '':
-                updated_style += ';'
-            updated_style += ' ' + font_declaration + ';'
+def templated_filename(filename):
+    """
+    Return the default output filename or path for a template:
+    email.html -> email_templated.html, email.htm -> email_templated.htm.
+    """
+    base, ext = os.path.splitext(filename)
+    return base + '_templated' + ext
 
-        tag['style'] = updated_style.strip()
+def same_path(a, b):
+    """
+    Return True if ``a`` and ``b`` name the same file, whether or not it exists.
+    """
+    return os.path.normcase(os.path.realpath(a)) == os.path.normcase(os.path.realpath(b))
 
-    # Handle <style> tags with actual CSS code inside
-    for style_tag in soup.find_all('style'):
-        if style_tag.string:
-            new_css = re.sub(
-                r'font-family\s*:\s*[^;]+;?',
-                font_declaration + ';',
-                style_tag.string,
-                flags=re.IGNORECASE
-            )
-            style_tag.string.replace_with(new_css)
+@lru_cache(maxsize=None)
+def _file_mode():
+    # The mode open() would give a new file; mkstemp always uses 0600
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
 
+@contextlib.contextmanager
+def replaced_on_success(path):
+    """
+    Yield a temporary path in the directory of ``path`` and move it over
+    ``path`` once the block finishes. If the block raises, the temporary file
+    is removed and ``path`` is left as it was. The temporary name ends with
+    the base name of ``path``, so its extension is kept.
+    """
+    import tempfile
+    
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.',
+                                     suffix='.' + os.path.basename(path))
+    os.close(fd)
+    try:
+        os.chmod(temp_path, _file_mode())
+        yield temp_path
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
 
-def process_html_file(input_path, output_path):
+def _process_file_task(task, options):
     """
-    Process a single HTML file according to the transformation rules.
+    Process one file for a batch run, turning any error into a failed record
+    so that a bad file is reported instead of aborting the whole batch.
+    """
+    input_path, output_path = task
+    try:
+        return process_html_file(input_path, output_path, **options)
+    except Exception as e:
+        return _failed_record(input_path, output_path, e)
+
+def _failed_record(input_path, output_path, error):
+    return {
+        'input': input_path, 'output': output_path, 'status': 'failed',
+        'error': f'{type(error).__name__}: {error}', 'encoding': None, 'bytes': None, 'sha256': None,
+        'seconds': None, 'stages': {}, 'counters': {},
+    }
+
+def run_tasks(tasks, jobs=None, **options):
+    """
+    Run file tasks across a process pool, yielding their records in task
+    order. ``tasks`` may be any iterable, including a generator; it is
+    consumed only a few tasks per worker ahead of the results. ``options``
+    are passed on to process_html_file.
     """
-    # Read the HTML file with proper encoding handling
-    html = None
-    encodings_to_try = ['utf-8', 'utf-8-sig', 'latin-1', 'cp1252']
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1:
+        for task in tasks:
+            yield _process_file_task(task, options)
+        return
     
-    for encoding in encodings_to_try:
+    def resolve(task, future):
         try:
-            with open(input_path, 'r', encoding=encoding) as f:
-                html = f.read()
-            print(f"Successfully read file with {encoding} encoding")
-            break
-        except UnicodeDecodeError:
-            continue
+            return future.result()
+        except Exception as e:
+            # The worker process itself died (e.g. killed or out of memory)
+            return _failed_record(task[0], task[1], e)
     
-    if html is None:
-        raise ValueError(f"Could not read {input_path} with any of the attempted encodings")
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        window = collections.deque()
+        for task in tasks:
+            window.append((task, executor.submit(_process_file_task, task, options)))
+            if len(window) >= jobs * 4:
+                yield resolve(*window.popleft())
+        while window:
+            yield resolve(*window.popleft())
+
+def process_html_bytes(data, name, parser=DEFAULT_PARSER, engine='tree', output=DEFAULT_OUTPUT_MODE,
+                       originals=False):
+    """
+    Transform one document held in memory. ``name`` identifies it in the
+    record. Returns the output as UTF-8 bytes with a BOM, as written to
+    files, and the document's record. With ``originals``, the record also
+    holds the captured original content under 'originals'.
+    """
+    pipeline = build_pipeline(parser, output)
+    timer = StageTimer()
+    start = time.perf_counter()
+    record = {
+        'input': name, 'output': name, 'status': 'ok', 'error': None,
+        'encoding': None, 'bytes': len(data), 'seconds': None, 'stages': timer.stages,
+        'counters': timer.counters,
+    }
     
-    # Clean the HTML content before parsing
-    html = clean_text_content(html)
+    with timer.stage('decode'):
+        html, record['encoding'] = pipeline.decode(data)
+    
+    buffer = io.StringIO()
+    if engine == 'stream':
+        from engine import inline_style_cache_counts, record_inline_style_counts
+        from streaming import rewrite_stream
+        cache_counts = inline_style_cache_counts()
+        with timer.stage('stream'):
+            rewrite_stream([html], buffer.write, pipeline.rules)
+        record_inline_style_counts(timer, cache_counts)
+    else:
+        captured = [] if originals else None
+        pipeline.write_html(html, buffer, timer, captured)
+        if originals:
+            record['originals'] = captured
+    result = buffer.getvalue().encode('utf-8-sig')
+    
+    record['seconds'] = time.perf_counter() - start
+    return result, record
+
+def _archive_member_task(name, data, options):
+    try:
+        return process_html_bytes(data, name, **options)
+    except Exception as e:
+        return None, _failed_record(name, name, e)
+
+def _map_archive_members(members, jobs, options):
+    """
+    Yield (member, data, result) in archive order, where ``result`` is the
+    (output, record) pair for HTML templates and None for members that are
+    copied unchanged. At most a few members per worker are held in memory.
+    """
+    def wants_transform(member):
+        name = member.name.lower()
+        return not member.is_dir and name.endswith('.html') and not name.endswith('_templated.html')
     
-    # Parse with explicit encoding
-    soup = BeautifulSoup(html, 'html.parser', from_encoding='utf-8')
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1:
+        for member, data in members:
+            result = _archive_member_task(member.name, data, options) if wants_transform(member) else None
+            yield member, data, result
+        return
     
-    # Ensure proper UTF-8 meta tags are present
-    ensure_utf8_meta_tag(soup)
+    def resolve(member, data, future):
+        if future is None:
+            return member, data, None
+        try:
+            return member, data, future.result()
+        except Exception as e:
+            # The worker process itself died (e.g. killed or out of memory)
+            return member, data, (None, _failed_record(member.name, member.name, e))
     
-    # Apply transformations in order
-    replace_text_content(soup, ['p', 'li', 'span', 'em', 'strong', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'], '{{body_text}}')
-    replace_img_tags(soup)
-    replace_a_tags(soup)
-    replace_font_family_styles(soup)
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        window = collections.deque()
+        for member, data in members:
+            future = None
+            if wants_transform(member):
+                future = executor.submit(_archive_member_task, member.name, data, options)
+            window.append((member, data, future))
+            if len(window) >= jobs * 4:
+                yield resolve(*window.popleft())
+        while window:
+            yield resolve(*window.popleft())
+
+def process_archive(input_path, output_path, jobs=None, report=None, **options):
+    """
+    Transform the HTML templates of a zip or tar(.gz) bundle into a new
+    archive, in memory. Other members (images, fonts, templates already
+    ending in ``_templated.html``) are copied unchanged. Original-content
+    sidecars are added as members next to their templates. A template that
+    fails is reported and left out of the output archive. ``options`` are
+    passed on to process_html_bytes; the result cache is not used. Returns
+    the run's RunReport (``report`` if given) and the number of members
+    copied unchanged. The archive is written to a temporary file next to
+    ``output_path`` and only moved into place once it is complete.
+    """
+    from archive import ArchiveWriter, Member, read_members
     
-    # Write the transformed HTML with proper UTF-8 encoding and BOM
-    with open(output_path, 'w', encoding='utf-8-sig') as f:
-        f.write(soup.prettify(formatter="html"))
+    options.pop('cache', None)
+    report = report if report is not None else RunReport()
+    copied = 0
+    with replaced_on_success(output_path) as temp_path, ArchiveWriter(temp_path) as writer:
+        for member, data, result in _map_archive_members(read_members(input_path), jobs, options):
+            if result is None:
+                writer.add(member, data)
+                if not member.is_dir:
+                    copied += 1
+                continue
+            output, record = result
+            record.update(input=f'{input_path}:{member.name}', output=f'{output_path}:{member.name}',
+                          archive=input_path, member=member.name)
+            captured = record.pop('originals', None)
+            if output is not None:
+                writer.add(member, output)
+                if captured is not None:
+                    sidecar = Member(originals_path(member.name), member.mtime, 0o644, False)
+                    writer.add(sidecar, originals_jsonl(captured))
+            print(describe(record))
+            report.add(record)
     
-    print(f'Successfully processed: {input_path} -> {output_path}')
+    print(f'\nSummary: {report.succeeded} succeeded, {report.failed} failed, {copied} copied unchanged')
+    return report, copied
 
-def process_directory(input_dir, output_dir):
+def _template_globs(include=None, exclude=None):
     """
-    Process all HTML files in a directory.
+    Return the (include, exclude) globs of a directory run: ``include`` or
+    the default, and ``exclude`` on top of the default excludes. Passing the
+    result in again returns it unchanged.
+    """
+    exclude = tuple(pattern for pattern in exclude or () if pattern not in DEFAULT_EXCLUDE)
+    return tuple(include or DEFAULT_INCLUDE), DEFAULT_EXCLUDE + exclude
+
+def process_directory(input_dir, output_dir, jobs=None, include=None, exclude=None, resume=False,
+                      report=None, skeletons=None, shard=None, **options):
     """
+    Process the HTML files in a directory tree.
+
+    Files whose path relative to ``input_dir`` matches an ``include`` glob
+    and no ``exclude`` glob (see batch.iter_templates; files ending in
+    ``_templated.html`` are always excluded) are processed by up
+    to ``jobs`` worker processes (default: CPU count) and written to the
+    same relative path under ``output_dir``. Files are found and reported in
+    path order without listing the whole tree up front, and every finished
+    file is appended to a journal in ``output_dir``; with ``resume`` the
+    files a previous run already finished are skipped. With a SkeletonStore
+    as ``skeletons``, every output is also added to it. With ``shard`` as
+    (K, N), only the files that hash to shard K of N are processed (see
+    shards.shard_of); the journal is kept per shard and every finished file
+    is also appended to the shard's manifest in ``output_dir``. ``options`` are
+    passed on to process_html_file. Returns the run's RunReport (``report``
+    if given) and the number of excluded files.
+    """
+    report = report if report is not None else RunReport()
     if not os.path.exists(input_dir):
         print(f"Error: Input directory '{input_dir}' does not exist.")
-        return
+        return report, 0
     
     os.makedirs(output_dir, exist_ok=True)
+    journal = Journal(os.path.join(output_dir, shard_name(JOURNAL_NAME, shard)), resume=resume)
+    manifest = None
+    if shard is not None:
+        manifest = ShardManifest(manifest_path(output_dir, shard), shard, resume=resume)
+    counts = {'skipped': 0, 'done': 0, 'other_shards': 0}
     
-    html_files = [f for f in os.listdir(input_dir) if f.lower().endswith('.html')]
+    def tasks():
+        templates = iter_templates(input_dir, *_template_globs(include, exclude), skip_dirs=[output_dir])
+        for relative, excluded in templates:
+            if shard is not None and shard_of(relative, shard[1]) != shard[0]:
+                counts['other_shards'] += 1
+                continue
+            if excluded:
+                counts['skipped'] += 1
+                continue
+            if journal.finished(relative):
+                counts['done'] += 1
+                continue
+            directory, filename = os.path.split(relative)
+            target_dir = os.path.join(output_dir, directory)
+            os.makedirs(target_dir, exist_ok=True)
+            yield os.path.join(input_dir, relative), os.path.join(target_dir, templated_filename(filename))
     
-    if not html_files:
+    try:
+        for record in run_tasks(tasks(), jobs, **options):
+            print(describe(record))
+            relative = record['relative'] = os.path.relpath(record['input'], input_dir)
+            if skeletons is not None and record['status'] != 'failed':
+                skeletons.add_file(relative, record['output'])
+            journal.append(relative, record)
+            if manifest is not None:
+                manifest.append(relative, record)
+            report.add(record)
+    finally:
+        journal.close()
+        if manifest is not None:
+            manifest.close()
+    
+    if not len(report) and not counts['skipped'] and not counts['done'] and not counts['other_shards']:
         print(f"No HTML files found in '{input_dir}'")
-        return
+        return report, 0
     
-    for filename in html_files:
-        input_path = os.path.join(input_dir, filename)
-        output_filename = filename.replace('.html', '_templated.html')
-        output_path = os.path.join(output_dir, output_filename)
-        process_html_file(input_path, output_path)
+    summary = f'\nSummary: {report.succeeded} succeeded, {report.failed} failed, {counts["skipped"]} skipped'
+    if resume:
+        summary += f', {counts["done"]} already done'
+    if shard is not None:
+        summary += f', {counts["other_shards"]} in other shards'
+    print(summary)
+    return report, counts['skipped']
+
+SERVE_OPTIONS = {'parser': PARSERS, 'engine': ENGINES, 'output_mode': OUTPUT_MODES, 'originals': (True, False)}
+
+def serve_request(request, cache=None, **defaults):
+    """
+    Handle one --serve request and return its response (see serve_jsonl).
+    """
+    options = dict(defaults)
+    for key, value in (request.get('options') or {}).items():
+        if key not in SERVE_OPTIONS:
+            raise ValueError(f"unknown option '{key}'")
+        if value not in SERVE_OPTIONS[key]:
+            raise ValueError(f"invalid value for '{key}': {value!r}")
+        options['output' if key == 'output_mode' else key] = value
+    if options['originals'] and options['engine'] != 'tree':
+        raise ValueError("'originals' needs the tree engine")
+    
+    response = {'id': request.get('id')}
+    if 'html' in request:
+        output, record = process_html_bytes(request['html'].encode('utf-8'), 'request', **options)
+        response['html'] = output.decode('utf-8-sig')
+        if options['originals']:
+            response['originals'] = record.pop('originals')
+    elif 'input' in request:
+        output_path = request.get('output') or templated_filename(request['input'])
+        if same_path(output_path, request['input']):
+            raise ValueError('the output path is the input path')
+        record = process_html_file(request['input'], output_path, cache=cache, **options)
+        response['output'] = output_path
+    else:
+        raise ValueError("a request needs 'input' or 'html'")
+    response.update(status=record['status'], error=None, encoding=record['encoding'], seconds=record['seconds'],
+                    stages={name: entry['seconds'] for name, entry in record['stages'].items()})
+    return response
+
+def serve_jsonl(lines, write, cache=None, **defaults):
+    """
+    Answer JSONL transform requests one by one, so that a resident worker
+    pays interpreter startup and imports once for many documents.
+
+    Every line of ``lines`` is a request, either a file or inline HTML:
+
+        {"id": 1, "input": "a.html", "output": "a_out.html", "options": {...}}
+        {"id": 2, "html": "<html>...</html>", "options": {...}}
+
+    ``output`` defaults to the input with ``_templated`` appended (see
+    templated_filename) and may not be the input itself, and
+    ``options`` (all optional) overrides ``defaults`` for the request:
+    ``parser``, ``engine``, ``output_mode`` and ``originals``. Each request
+    is answered with one JSON line passed to ``write``, in request order:
+
+        {"id", "status", "output" or "html", "error", "encoding", "seconds", "stages"}
+
+    ``status`` is 'ok', 'cached' or 'failed' (with ``error`` set, also for
+    malformed requests). Inline requests with ``originals`` also get the
+    captured original content under 'originals'. Returns the number of
+    requests answered.
+    """
+    count = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        request = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('a request must be a JSON object')
+            response = serve_request(request, cache, **defaults)
+        except Exception as e:
+            request_id = request.get('id') if isinstance(request, dict) else None
+            response = {'id': request_id, 'status': 'failed', 'error': f'{type(e).__name__}: {e}'}
+        write(json.dumps(response, ensure_ascii=False) + '\n')
+        count += 1
+    return count
+
+def watch_and_process(input_dir, output_dir, jobs=None, debounce=0.3, include=None, exclude=None, **options):
+    """
+    Process a directory tree, then keep running and retransform each
+    template as soon as it is created or modified, in subdirectories too.
+    ``include`` and ``exclude`` select the templates as for
+    process_directory. Runs until interrupted.
+    """
+    include, exclude = _template_globs(include, exclude)
+    initial = snapshot(input_dir, include, exclude, skip_dirs=[output_dir])
+    process_directory(input_dir, output_dir, jobs=jobs, include=include, exclude=exclude, **options)
+    print(f"\nWatching '{input_dir}' for changes (Ctrl+C to stop)...")
+    
+    def on_change(relative):
+        directory, filename = os.path.split(relative)
+        target_dir = os.path.join(output_dir, directory)
+        os.makedirs(target_dir, exist_ok=True)
+        input_path = os.path.join(input_dir, relative)
+        output_path = os.path.join(target_dir, templated_filename(filename))
+        print(describe(_process_file_task((input_path, output_path), options)))
+    
+    try:
+        watch_directory(input_dir, on_change, debounce=debounce, initial=initial,
+                        include=include, exclude=exclude, skip_dirs=[output_dir])
+    except KeyboardInterrupt:
+        print('\nStopped watching.')
 
 def main():
     """
@@ -321,6 +570,9 @@ def main():
     """
     import argparse
     
+    if sys.argv[1:2] == ['merge']:
+        return merge_main(sys.argv[2:])
+    
     parser = argparse.ArgumentParser(
         description='Transform HTML email templates by replacing content with placeholders.',
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -329,31 +581,300 @@ Examples:
   python main.py task_email.html
   python main.py task_email.html --output my_template.html
   python main.py ./email_templates/ --output ./templated_emails/
+  python main.py ./email_templates/ --jobs 8
+  python main.py ./email_templates/ --include '*/promo/*.html' --exclude 'drafts/'
+  python main.py ./email_templates/ --resume
+  python main.py ./email_templates/ --output ./out/ --shard 2/4
+  python main.py merge ./out/ --input ./email_templates/ --output merged.jsonl
+  python main.py ./email_templates/ --skeletons ./skeletons/
+  python main.py ./email_templates/ --originals
+  python main.py ./email_templates/ --no-cache
+  python main.py ./email_templates/ --output-mode compact
+  python main.py bundle.zip --output templated.zip
+  python main.py --watch ./email_templates/
+  python main.py --serve < requests.jsonl > responses.jsonl
+  python main.py ./email_templates/ --report run.json --profile ./profiles/
         """
     )
     
-    parser.add_argument('input', help='Input HTML file or directory containing HTML files')
+    parser.add_argument('input', nargs='?',
+                        help='Input HTML file, directory of HTML files, or .zip/.tar.gz bundle')
     parser.add_argument('--output', '-o', help='Output file or directory (optional)')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running and retransform templates in the input directory as they change')
+    parser.add_argument('--serve', action='store_true',
+                        help='Stay resident and answer JSONL transform requests from stdin on stdout, '
+                             'one line each, instead of processing an input path')
+    parser.add_argument('--debounce', type=float, default=0.3,
+                        help='Seconds a changed file must stay unchanged before --watch processes it '
+                             '(default: %(default)s)')
+    parser.add_argument('--jobs', '-j', type=int, default=None,
+                        help='Number of worker processes for directories (default: CPU count)')
+    parser.add_argument('--include', action='append', default=None, metavar='GLOB',
+                        help='Only process files under a directory whose relative path matches GLOB; '
+                             'may be repeated (default: *.html)')
+    parser.add_argument('--exclude', action='append', default=None, metavar='GLOB',
+                        help='Also skip files matching GLOB, and directories matching it with a trailing /; '
+                             'may be repeated (*_templated.html files are always skipped)')
+    parser.add_argument('--resume', action='store_true',
+                        help='Skip the files an interrupted directory run already finished, '
+                             f'as recorded in {JOURNAL_NAME} in the output directory')
+    parser.add_argument('--shard', type=_shard_argument, default=None, metavar='K/N',
+                        help='Only process the files of a directory whose relative path hashes to shard K '
+                             'of N, and write a per-shard manifest to the output directory; combine the '
+                             'manifests with "main.py merge"')
+    parser.add_argument('--skeletons', default=None, metavar='DIR',
+                        help='Also store each distinct output of a directory run once in DIR, with a '
+                             f'{MANIFEST_NAME} mapping every input file to its skeleton')
+    parser.add_argument('--similarity', type=float, default=DEFAULT_SIMILARITY,
+                        help='Estimated similarity (0-1) above which --skeletons links a new skeleton '
+                             'to an earlier one (default: %(default)s)')
+    parser.add_argument('--parser', choices=PARSERS, default=DEFAULT_PARSER,
+                        help=f'HTML tree builder to parse with (default: {DEFAULT_PARSER})')
+    parser.add_argument('--engine', choices=ENGINES, default='tree',
+                        help='tree: BeautifulSoup, prettified output; stream: token-level '
+                             'rewriter with memory bounded by nesting depth (default: tree)')
+    parser.add_argument('--output-mode', choices=OUTPUT_MODES, default=DEFAULT_OUTPUT_MODE,
+                        help='pretty: re-indented; compact: no added whitespace, streamed to the file; '
+                             'preserve: compact and keeps the source whitespace (default: %(default)s). '
+                             'The stream engine always writes compact output')
+    parser.add_argument('--originals', action='store_true',
+                        help='Also write the replaced text, URLs and image details of each template to a '
+                             '.originals.jsonl sidecar next to its output (tree engine only; bypasses the cache)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Always transform, without reading or writing the result cache')
+    parser.add_argument('--cache-dir', default=None,
+                        help=f'Result cache directory (default: {default_cache_dir()})')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help='Maximum result cache size in MB (default: %(default)s)')
+    parser.add_argument('--report', default=None,
+                        help='Write per-stage timings and p50/p95/p99 latencies to this file '
+                             '(JSON, or CSV if it ends in .csv)')
+    parser.add_argument('--profile', default=None, metavar='DIR',
+                        help='Re-run the slowest documents under cProfile and write .prof dumps to DIR')
+    parser.add_argument('--profile-top', type=int, default=5,
+                        help='Number of slowest documents to profile (default: %(default)s)')
     
     args = parser.parse_args()
     
+    if args.serve:
+        if args.input:
+            parser.error('--serve reads its requests from stdin and takes no input path')
+        return _serve(args)
+    if not args.input:
+        parser.error('the following arguments are required: input')
+    
+    if args.shard and not os.path.isdir(args.input):
+        print('Error: --shard needs an input directory.')
+        return
+    
     if not os.path.exists(args.input):
         print(f"Error: Input path '{args.input}' does not exist.")
         return
     
-    if os.path.isdir(args.input):
+    if args.originals and args.engine != 'tree':
+        print("Error: --originals needs --engine tree.")
+        return
+    
+    cache = _cache_from_args(args)
+    options = {'parser': args.parser, 'engine': args.engine, 'output': args.output_mode, 'cache': cache,
+               'originals': args.originals}
+    
+    report = RunReport(keep=max(100, args.profile_top))
+    if args.watch:
+        if not os.path.isdir(args.input):
+            print(f"Error: --watch needs a directory, got '{args.input}'.")
+            return
+        output_dir = args.output or args.input + '_templated'
+        watch_and_process(args.input, output_dir, jobs=args.jobs, debounce=args.debounce,
+                          include=args.include, exclude=args.exclude, **options)
+    elif archive_format(args.input):
+        # Process a zip or tar(.gz) bundle into a new archive
+        output_archive = args.output or templated_archive_name(args.input)
+        if not archive_format(output_archive):
+            print(f"Error: Output for an archive must be a .zip, .tar.gz, .tgz or .tar file, got '{output_archive}'.")
+            return
+        if same_path(output_archive, args.input):
+            print(f"Error: Output would overwrite the input '{args.input}'.")
+            return
+        process_archive(args.input, output_archive, jobs=args.jobs, report=report, **options)
+        _print_summary(report)
+    elif os.path.isdir(args.input):
         # Process directory
         output_dir = args.output or args.input + '_templated'
-        process_directory(args.input, output_dir)
+        skeletons = None
+        if args.skeletons:
+            skeletons = SkeletonStore(args.skeletons, args.similarity, resume=args.resume,
+                                      manifest_name=shard_name(MANIFEST_NAME, args.shard))
+        try:
+            process_directory(args.input, output_dir, jobs=args.jobs, include=args.include,
+                              exclude=args.exclude, resume=args.resume, report=report,
+                              skeletons=skeletons, shard=args.shard, **options)
+        finally:
+            if skeletons is not None:
+                skeletons.close()
+        _print_summary(report)
+        if skeletons is not None:
+            print(f'\nSkeletons: {skeletons.sources} files -> {len(skeletons.signatures)} distinct, '
+                  f'{skeletons.near_duplicates} near-duplicates, in {args.skeletons}')
     else:
         # Process single file
         if not args.input.lower().endswith('.html'):
             print("Warning: Input file doesn't have .html extension")
         
-        output_file = args.output or args.input.replace('.html', '_templated.html')
-        process_html_file(args.input, output_file)
+        output_file = args.output or templated_filename(args.input)
+        if same_path(output_file, args.input):
+            print(f"Error: Output would overwrite the input '{args.input}'.")
+            return
+        record = process_html_file(args.input, output_file, **options)
+        print(describe(record))
+        report.add(record)
+    
+    if args.report and len(report):
+        write_report(args.report, report)
+        print(f'Report written to {args.report}')
+    if args.profile and len(report):
+        _profile(report, args.profile, args.profile_top, options)
+    
+    if cache is not None:
+        cache.evict()
+    if report.failed:
+        sys.exit(1)
+
+def _cache_from_args(args):
+    if args.no_cache:
+        return None
+    return ResultCache(args.cache_dir, max_bytes=args.cache_size * 1024 * 1024)
+
+def _serve(args):
+    """
+    Run serve_jsonl on stdin and stdout until stdin is closed. Anything else
+    printed meanwhile goes to stderr, so stdout carries only responses.
+    """
+    if args.originals and args.engine != 'tree':
+        print('Error: --originals needs --engine tree.', file=sys.stderr)
+        return 1
+    cache = _cache_from_args(args)
+    out = sys.stdout
+    build_pipeline(args.parser, args.output_mode)
+    
+    def write(line):
+        out.write(line)
+        out.flush()
+    
+    with contextlib.redirect_stdout(sys.stderr):
+        serve_jsonl(sys.stdin, write, cache, parser=args.parser, engine=args.engine,
+                    output=args.output_mode, originals=args.originals)
+    if cache is not None:
+        cache.evict()
+    return 0
+
+def _shard_argument(text):
+    import argparse
+    try:
+        return parse_shard(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def merge_main(argv):
+    """
+    The ``merge`` subcommand: combine the manifests of a sharded run and
+    report missing, duplicate and misplaced entries.
+    """
+    import argparse
+    import glob
+    
+    parser = argparse.ArgumentParser(
+        prog='main.py merge',
+        description='Combine the shard manifests of a --shard run and check that they cover the corpus once.')
+    parser.add_argument('manifests', nargs='+',
+                        help='Shard manifest files, or output directories to collect them from')
+    parser.add_argument('--input', default=None, metavar='DIR',
+                        help='The corpus the shards were run on; files of it that no shard processed '
+                             'are reported as missing')
+    parser.add_argument('--include', action='append', default=None, metavar='GLOB',
+                        help='The --include globs of the sharded run')
+    parser.add_argument('--exclude', action='append', default=None, metavar='GLOB',
+                        help='The --exclude globs of the sharded run')
+    parser.add_argument('--output', '-o', default=None,
+                        help='Write the merged manifest (one JSON line per file, in path order) to this file')
+    args = parser.parse_args(argv)
+    
+    paths = []
+    for path in args.manifests:
+        if os.path.isdir(path):
+            found = sorted(glob.glob(os.path.join(glob.escape(path), shard_name(MANIFEST_PREFIX + '.jsonl', ('*', '*')))))
+            if not found:
+                print(f"Error: No shard manifests found in '{path}'.")
+                return 1
+            paths.extend(found)
+        else:
+            paths.append(path)
+    
+    expected = None
+    if args.input:
+        templates = iter_templates(args.input, *_template_globs(args.include, args.exclude))
+        expected = [relative.replace(os.sep, '/') for relative, excluded in templates if not excluded]
+    
+    try:
+        entries, problems = merge_manifests(paths, expected)
+    except (OSError, ValueError) as e:
+        print(f'Error: {e}')
+        return 1
+    
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + '\n')
+        print(f'Merged manifest written to {args.output}')
+    
+    for message in problems['shards']:
+        print(f'Error: {message}')
+    for name, label in (('missing', 'Missing (no shard processed it)'), ('duplicates', 'Duplicate'),
+                        ('misplaced', 'In the wrong shard'), ('failed', 'Failed')):
+        for path in problems[name]:
+            print(f'{label}: {path}')
+    
+    ok = sum(entry['status'] != 'failed' for entry in entries)
+    print(f'\nSummary: {len(paths)} manifests, {len(entries)} files, {ok} succeeded, '
+          f'{len(problems["failed"])} failed, {len(problems["missing"])} missing, '
+          f'{len(problems["duplicates"])} duplicates, {len(problems["misplaced"])} misplaced')
+    return 1 if any(problems.values()) else 0
+
+def _print_summary(report):
+    summary = report.summary()
+    if summary:
+        print('\n' + format_summary(summary))
+    hits = report.counters.get('inline_style_hits', 0)
+    misses = report.counters.get('inline_style_misses', 0)
+    if hits or misses:
+        print(f'\nInline style cache: {hits} hits, {misses} misses ({hits / (hits + misses):.0%} hit rate)')
+    skipped = {name.split(':', 1)[1]: count for name, count in report.counters.items()
+               if name.startswith('skipped:')}
+    if skipped:
+        print(f'Skipped by the prefilter (of {report.succeeded} documents): '
+              + ', '.join(f'{name} {count}' for name, count in sorted(skipped.items())))
+
+def _profile(report, directory, top, options):
+    """
+    Write cProfile dumps for the slowest documents of a run. The documents are
+    transformed again without the cache, into a scratch directory.
+    """
+    import tempfile
+    from archive import read_member
+    
+    options = {key: value for key, value in options.items() if key != 'cache'}
+    with tempfile.TemporaryDirectory() as scratch:
+        def run(record):
+            if 'member' in record:
+                data = read_member(record['archive'], record['member'])
+                process_html_bytes(data, record['member'], **options)
+            else:
+                process_html_file(record['input'], os.path.join(scratch, 'profiled.html'), **options)
+        for path in profile_slowest(report, directory, top, run):
+            print(f'Profile written to {path}')
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
 
     
\ No newline at end of file
@@ -0,0 +1,172 @@
+"""
+Reusable, preconfigured transform pipeline.
+
+A ``TransformPipeline`` holds one configuration (placeholders, enabled rules,
+parser) and the rule objects built from it. The rule patterns are compiled at
+import time in engine.py, so after construction a ``transform`` call only
+parses, walks and serializes the document. Build one per configuration and
+reuse it for every document. Rules keep per-document state in the handlers
+``apply_rules`` creates for each document, not on the rule objects, so one
+instance can be shared by several threads (such as Streamlit sessions).
+"""
+from bs4 import BeautifulSoup
+
+from defaults import DEFAULT_OUTPUT_MODE, DEFAULT_PARSER, OUTPUT_MODES, PARSERS
+from engine import (
+    BODY_TEXT_TAGS, AnchorRule, BackgroundImageRule, FontFamilyRule, ImageRule, TextRule, apply_rules,
+    fuse_stylesheet_rules, normalize_html, scan_features,
+)
+from instrument import StageTimer
+from reader import decode
+from serializer import iter_compact, write_compact
+
+# Rules that can be enabled, in the order they are applied
+RULES = ('text', 'image', 'anchor', 'font_family', 'background_image')
+DEFAULT_RULES = ('text', 'image', 'anchor', 'font_family')
+
+
+def ensure_utf8_meta_tag(soup):
+    """
+    Ensure the HTML has proper UTF-8 meta tag in the head.
+    """
+    head = soup.find('head')
+    if not head:
+        # Create head tag if it doesn't exist
+        head = soup.new_tag('head')
+        soup.html.insert(0, head)
+
+    # Check if charset meta tag already exists
+    charset_meta = head.find('meta', charset=True)
+    if charset_meta:
+        charset_meta['charset'] = 'UTF-8'
+    else:
+        # Create new charset meta tag
+        meta_charset = soup.new_tag('meta', charset='UTF-8')
+        head.insert(0, meta_charset)
+
+    # Also add content-type meta tag for better compatibility
+    content_meta = head.find('meta', attrs={'http-equiv': 'Content-Type'})
+    if not content_meta:
+        meta_content = soup.new_tag('meta', http_equiv='Content-Type', content='text/html; charset=UTF-8')
+        head.insert(1, meta_content)
+
+
+class TransformPipeline:
+    """
+    A configured transform that can be applied to any number of documents.
+
+    ``text_placeholders`` maps tag names to the placeholder their text is
+    replaced with (default: every BODY_TEXT_TAGS tag to ``{{body_text}}``).
+    ``rules`` names the enabled rules (see RULES); they always run in RULES
+    order. ``parser`` is the BeautifulSoup tree builder. ``output`` is one of
+    serializer.OUTPUT_MODES: ``pretty`` re-indents the result, ``compact``
+    writes it without re-indentation and ``preserve`` additionally keeps the
+    source's whitespace instead of collapsing it before parsing.
+    """
+
+    def __init__(self, text_placeholders=None, href_placeholder='{{product_image_url}}',
+                 link_text_placeholder='{{body_text}}', alt_placeholder='{{alt_text}}',
+                 rules=DEFAULT_RULES, parser=DEFAULT_PARSER, output=DEFAULT_OUTPUT_MODE):
+        unknown = set(rules) - set(RULES)
+        if unknown:
+            raise ValueError(f"Unknown rules: {', '.join(sorted(unknown))}")
+        if parser not in PARSERS:
+            raise ValueError(f"Unknown parser '{parser}', expected one of {', '.join(PARSERS)}")
+        if output not in OUTPUT_MODES:
+            raise ValueError(f"Unknown output mode '{output}', expected one of {', '.join(OUTPUT_MODES)}")
+        if text_placeholders is None:
+            text_placeholders = dict.fromkeys(BODY_TEXT_TAGS, '{{body_text}}')
+
+        self.parser = parser
+        self.output = output
+        factories = {
+            'text': lambda: TextRule(text_placeholders),
+            'image': lambda: ImageRule(alt_placeholder),
+            'anchor': lambda: AnchorRule(href_placeholder, link_text_placeholder),
+            'font_family': FontFamilyRule,
+            'background_image': BackgroundImageRule,
+        }
+        # With both CSS rules enabled, each <style> block is rewritten in one pass
+        self.rules = fuse_stylesheet_rules([factories[name]() for name in RULES if name in rules])
+
+    def rules_for(self, html):
+        """
+        Return the rules that may change ``html``, judged by the features
+        a quick scan finds in it (see engine.scan_features).
+        """
+        features = scan_features(html)
+        return [rule for rule in self.rules if rule.features is None or features.intersection(rule.features)]
+
+    def build_tree(self, html, timer=None, originals=None):
+        """
+        Clean and parse an HTML string and apply the rules to it.
+        Returns the transformed BeautifulSoup tree. The replaced original
+        content is appended to ``originals`` if it is a list (see
+        engine.apply_rules).
+        """
+        timer = timer or StageTimer()
+
+        # Normalize the text between the tags before parsing
+        with timer.stage('clean'):
+            html = normalize_html(html, collapse_whitespace=self.output != 'preserve')
+
+        # Leave out the rules that cannot match anything in this document
+        with timer.stage('prefilter'):
+            rules = self.rules_for(html)
+        for rule in self.rules:
+            if rule not in rules:
+                timer.count('skipped:' + type(rule).__name__)
+
+        # Parse the decoded text with the selected tree builder
+        with timer.stage('parse'):
+            soup = BeautifulSoup(html, self.parser)
+
+        # Ensure proper UTF-8 meta tags are present
+        with timer.stage('ensure_utf8_meta_tag'):
+            ensure_utf8_meta_tag(soup)
+
+        # Apply all transformations in a single traversal
+        with timer.stage('rules'):
+            apply_rules(soup, rules, timer, originals)
+        return soup
+
+    def transform_html(self, html, timer=None, originals=None):
+        """
+        Transform an HTML string and return the result as a string.
+        Stage timings are recorded on ``timer`` (an instrument.StageTimer) if given.
+        """
+        timer = timer or StageTimer()
+        soup = self.build_tree(html, timer, originals)
+        with timer.stage('serialize'):
+            if self.output == 'pretty':
+                return soup.prettify(formatter="html")
+            return ''.join(iter_compact(soup))
+
+    def write_html(self, html, f, timer=None, originals=None):
+        """
+        Transform an HTML string and write the result to the text file ``f``.
+        The non-pretty modes stream the output instead of building it first.
+        """
+        timer = timer or StageTimer()
+        soup = self.build_tree(html, timer, originals)
+        with timer.stage('serialize'):
+            if self.output == 'pretty':
+                f.write(soup.prettify(formatter="html"))
+            else:
+                write_compact(soup, f.write)
+
+    def decode(self, data):
+        """
+        Decode input bytes, sniffing the encoding from a BOM or <meta>
+        declaration (see reader.decode). Returns (text, encoding).
+        """
+        return decode(data)
+
+    def transform(self, data, timer=None):
+        """
+        Transform an HTML document given as bytes (or any bytes-like object)
+        and return the result as UTF-8 bytes with a BOM, exactly as main.py
+        writes output files.
+        """
+        html, _ = self.decode(data)
+        return self.transform_html(html, timer).encode('utf-8-sig')
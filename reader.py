@@ -0,0 +1,106 @@
+"""
+Byte-level input: each template is read once, and its encoding is sniffed
+from the bytes before a single decode.
+
+Files larger than ``MMAP_THRESHOLD`` are memory-mapped rather than copied
+into a bytes object, which keeps reads off the Python heap on network mounts.
+"""
+import codecs
+import mmap
+import re
+from contextlib import contextmanager
+
+SNIFF_BYTES = 4096
+MMAP_THRESHOLD = 1024 * 1024
+
+# Longest BOMs first so UTF-32 LE is not taken for UTF-16 LE
+BOMS = [
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+# Matches both <meta charset="..."> and the charset= inside an http-equiv
+# Content-Type meta's content attribute
+META_CHARSET_PATTERN = re.compile(rb'<meta[^>]*?charset\s*=\s*["\']?\s*([a-zA-Z0-9_.:-]+)', re.IGNORECASE)
+
+# Encodings tried when nothing better is known. cp1252 comes before latin-1:
+# it decodes the same bytes except for curly quotes, dashes and the euro
+# sign, which latin-1 silently turns into control characters.
+FALLBACK_ENCODINGS = ['cp1252', 'latin-1']
+
+
+@contextmanager
+def open_source(path, mmap_threshold=MMAP_THRESHOLD):
+    """
+    Yield the contents of ``path`` as a bytes-like object, read once.
+    Files of at least ``mmap_threshold`` bytes are memory-mapped.
+    """
+    with open(path, 'rb') as f:
+        size = f.seek(0, 2)
+        f.seek(0)
+        if size < mmap_threshold or size == 0:
+            yield f.read()
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+
+def declared_encoding(head):
+    """
+    Return the Python codec name declared by a <meta> tag in ``head`` (the
+    first bytes of a document), or None. Labels browsers read as
+    windows-1252 (latin-1, ascii) map to cp1252, and a UTF-16/32 declaration
+    in ASCII-compatible bytes is read as UTF-8.
+    """
+    match = META_CHARSET_PATTERN.search(head)
+    if not match:
+        return None
+    try:
+        name = codecs.lookup(match.group(1).decode('ascii')).name
+    except LookupError:
+        return None
+    if name in ('latin-1', 'iso8859-1', 'ascii'):
+        return 'cp1252'
+    if name.startswith(('utf-16', 'utf-32')):
+        return 'utf-8'
+    return name
+
+
+def candidate_encodings(head):
+    """
+    Return the encodings to try, in order, for a document starting with
+    ``head``.
+
+    A BOM is authoritative. Otherwise UTF-8 is tried first, even when a
+    <meta> tag declares something else, since exports often keep a stale
+    declaration after being saved as UTF-8; the declared encoding comes next.
+    """
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            candidates = [encoding]
+            break
+    else:
+        candidates = ['utf-8']
+        declared = declared_encoding(head)
+        if declared:
+            candidates.append(declared)
+    for encoding in FALLBACK_ENCODINGS:
+        if encoding not in candidates:
+            candidates.append(encoding)
+    return candidates
+
+
+def decode(data):
+    """
+    Decode ``data`` (bytes, or a mmap from open_source) using the first
+    candidate encoding that works. Returns (text, encoding).
+    """
+    for encoding in candidate_encodings(data[:SNIFF_BYTES]):
+        try:
+            return str(data, encoding), encoding
+        except UnicodeDecodeError:
+            continue
+    raise ValueError("Could not decode the input with any of the attempted encodings")
@@ -0,0 +1,93 @@
+"""
+Output serialization.
+
+``pretty`` is BeautifulSoup's ``prettify``, which re-indents every element.
+``compact`` and ``preserve`` write the tree as it was parsed, without
+re-indentation, streaming it to the output file in buffered pieces instead
+of building the whole document as one string. ``compact`` output equals
+``soup.decode(formatter="html")``.
+
+Prettifying adds whitespace between inline elements, which email clients
+render (for example as gaps between sliced images). The non-pretty modes do
+not add any whitespace.
+"""
+from bs4 import Tag
+from bs4.element import AttributeValueWithCharsetSubstitution
+from bs4.formatter import Formatter
+
+WRITE_BUFFER_SIZE = 64 * 1024
+
+
+def _start_tag(tag, formatter, eventual_encoding):
+    attrs = []
+    for key, val in formatter.attributes(tag):
+        if val is None:
+            attrs.append(key)
+            continue
+        if isinstance(val, (list, tuple)):
+            val = ' '.join(val)
+        elif not isinstance(val, str):
+            val = str(val)
+        elif isinstance(val, AttributeValueWithCharsetSubstitution) and eventual_encoding is not None:
+            val = val.substitute_encoding(eventual_encoding)
+        attrs.append(f'{key}={formatter.quoted_attribute_value(formatter.attribute_value(val))}')
+
+    prefix = f'{tag.prefix}:' if tag.prefix else ''
+    attribute_string = ' ' + ' '.join(attrs) if attrs else ''
+    closing = ''
+    if tag.is_empty_element:
+        closing = getattr(formatter, 'void_element_close_prefix', '/') or ''
+    return f'<{prefix}{tag.name}{attribute_string}{closing}>'
+
+
+def _end_tag(tag):
+    if tag.hidden:
+        return ''
+    prefix = f'{tag.prefix}:' if tag.prefix else ''
+    return f'</{prefix}{tag.name}>'
+
+
+def iter_compact(soup, formatter='html', eventual_encoding='utf-8'):
+    """
+    Yield the markup of ``soup`` piece by piece, without adding whitespace.
+
+    Walks the tree iteratively, so deeply nested documents do not hit the
+    recursion limit.
+    """
+    if not isinstance(formatter, Formatter):
+        formatter = soup.formatter_for_name(formatter)
+
+    open_tags = []
+    for element in soup.descendants:
+        # Close the tags that ended before this element
+        while open_tags and element.parent is not open_tags[-1]:
+            yield _end_tag(open_tags.pop())
+
+        if isinstance(element, Tag):
+            if not element.hidden:
+                yield _start_tag(element, formatter, eventual_encoding)
+            if not element.is_empty_element:
+                open_tags.append(element)
+        else:
+            yield element.output_ready(formatter)
+
+    while open_tags:
+        yield _end_tag(open_tags.pop())
+
+
+def write_compact(soup, write, formatter='html', buffer_size=WRITE_BUFFER_SIZE):
+    """
+    Serialize ``soup`` without re-indentation by calling ``write`` with
+    chunks of about ``buffer_size`` characters.
+    """
+    pieces = []
+    size = 0
+    for piece in iter_compact(soup, formatter):
+        pieces.append(piece)
+        size += len(piece)
+        if size >= buffer_size:
+            write(''.join(pieces))
+            pieces = []
+            size = 0
+    if pieces:
+        write(''.join(pieces))
@@ -0,0 +1,311 @@
+"""
+Local HTTP transform service.
+
+A small asyncio HTTP/1.1 server (standard library only) that hands documents
+to a bounded process pool:
+
+    POST /transform   raw HTML body -> templated HTML
+    POST /batch       {"documents": [{"name": ..., "html": ...}, ...]}
+                      -> {"results": [{"name", "status", "html" | "error", "seconds"}, ...]}
+    GET  /health      pool and queue statistics as JSON
+
+At most ``queue_depth`` documents are queued or running at once. A request
+that would go over that gets 429 with a Retry-After header instead of
+waiting, and a document that takes longer than ``timeout`` seconds gets 504.
+The service answers 503 while shutting down or if the pool has died.
+
+    python service.py --port 8080 --jobs 4 --queue-depth 16
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from defaults import DEFAULT_OUTPUT_MODE, DEFAULT_PARSER, OUTPUT_MODES, PARSERS
+from main import ENGINES, build_pipeline, process_html_bytes
+
+MAX_BODY_BYTES = 50 * 1024 * 1024
+MAX_HEADER_BYTES = 64 * 1024
+
+REASONS = {
+    200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+    411: 'Length Required', 413: 'Payload Too Large', 422: 'Unprocessable Entity',
+    429: 'Too Many Requests', 431: 'Request Header Fields Too Large', 501: 'Not Implemented',
+    503: 'Service Unavailable', 504: 'Gateway Timeout',
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+def _warm_worker(options):
+    # Build the pipeline once per worker process, before the first request
+    build_pipeline(options['parser'], options['output'])
+
+
+def _transform_document(data, options):
+    output, record = process_html_bytes(data, 'request', **options)
+    # HTTP responses declare their charset, so drop the BOM files get
+    return output[3:] if output.startswith(b'\xef\xbb\xbf') else output
+
+
+class TransformService:
+    """
+    Admission control and the process pool behind the HTTP handlers.
+    """
+
+    def __init__(self, jobs=None, queue_depth=None, timeout=30.0, parser=DEFAULT_PARSER,
+                 engine='tree', output=DEFAULT_OUTPUT_MODE):
+        self.jobs = jobs or os.cpu_count() or 1
+        self.queue_depth = queue_depth or self.jobs * 4
+        self.timeout = timeout
+        self.options = {'parser': parser, 'engine': engine, 'output': output}
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.jobs, initializer=_warm_worker, initargs=(self.options,))
+        self.in_flight = 0
+        self.draining = False
+        self.broken = False
+        self.started = time.monotonic()
+        self.stats = {'completed': 0, 'failed': 0, 'rejected': 0, 'timed_out': 0}
+
+    def health(self):
+        return {
+            'status': 'unavailable' if self.draining or self.broken else 'ok',
+            'workers': self.jobs,
+            'queue_depth': self.queue_depth,
+            'in_flight': self.in_flight,
+            'timeout': self.timeout,
+            'uptime': round(time.monotonic() - self.started, 3),
+            **self.stats,
+            **self.options,
+        }
+
+    def admit(self, count):
+        """
+        Reserve ``count`` queue slots or raise HTTPError 429/503.
+        """
+        if self.draining or self.broken:
+            raise HTTPError(503, 'Service is shutting down' if self.draining else 'Worker pool is unavailable')
+        if count > self.queue_depth:
+            raise HTTPError(413, f'Batch of {count} documents exceeds the queue depth of {self.queue_depth}')
+        if self.in_flight + count > self.queue_depth:
+            self.stats['rejected'] += 1
+            raise HTTPError(429, 'Transform queue is full', {'Retry-After': '1'})
+        self.in_flight += count
+
+    def _release(self, _future):
+        self.in_flight -= 1
+
+    async def transform(self, data):
+        """
+        Transform one document in the pool. The caller must have admitted it.
+        The queue slot is released when the worker finishes, even if the
+        request has already timed out.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            future = loop.run_in_executor(self.executor, _transform_document, data, self.options)
+        except BrokenProcessPool:
+            self.in_flight -= 1
+            self.broken = True
+            raise HTTPError(503, 'Worker pool is unavailable')
+        future.add_done_callback(self._release)
+        try:
+            result = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            self.stats['timed_out'] += 1
+            raise HTTPError(504, f'Transform took longer than {self.timeout:g} seconds')
+        except BrokenProcessPool:
+            self.broken = True
+            raise HTTPError(503, 'Worker pool is unavailable')
+        except Exception as e:
+            self.stats['failed'] += 1
+            raise HTTPError(422, f'{type(e).__name__}: {e}')
+        self.stats['completed'] += 1
+        return result
+
+    async def transform_batch(self, documents):
+        async def one(document):
+            start = time.perf_counter()
+            try:
+                html = await self.transform(document['html'].encode('utf-8'))
+            except HTTPError as e:
+                return {'name': document.get('name'), 'status': e.status, 'error': str(e),
+                        'seconds': time.perf_counter() - start}
+            return {'name': document.get('name'), 'status': 200, 'html': html.decode('utf-8'),
+                    'seconds': time.perf_counter() - start}
+        return await asyncio.gather(*(one(document) for document in documents))
+
+    def shutdown(self):
+        self.draining = True
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+async def _read_request(reader):
+    """
+    Read one request. Returns (method, path, headers, body), or None when the
+    client closed the connection.
+    """
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+    except asyncio.IncompleteReadError:
+        return None
+    except asyncio.LimitOverrunError:
+        raise HTTPError(431, 'Request headers too large')
+
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, path, _ = lines[0].split(' ', 2)
+    except ValueError:
+        raise HTTPError(400, 'Malformed request line')
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+
+    if 'transfer-encoding' in headers:
+        raise HTTPError(501, 'Chunked request bodies are not supported; send Content-Length')
+    length = headers.get('content-length')
+    if length is None:
+        if method == 'POST':
+            raise HTTPError(411, 'Content-Length is required')
+        return method, path, headers, b''
+    try:
+        length = int(length)
+    except ValueError:
+        raise HTTPError(400, 'Invalid Content-Length')
+    if length < 0:
+        raise HTTPError(400, 'Invalid Content-Length')
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(413, f'Request body is larger than {MAX_BODY_BYTES} bytes')
+    body = await reader.readexactly(length)
+    return method, path, headers, body
+
+
+def _response(status, body, content_type, headers=None, keep_alive=True):
+    lines = [
+        f'HTTP/1.1 {status} {REASONS.get(status, "")}',
+        f'Content-Type: {content_type}',
+        f'Content-Length: {len(body)}',
+        'Connection: keep-alive' if keep_alive else 'Connection: close',
+    ]
+    lines += [f'{name}: {value}' for name, value in (headers or {}).items()]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+
+def _json(status, payload, headers=None, keep_alive=True):
+    body = json.dumps(payload).encode('utf-8')
+    return _response(status, body, 'application/json', headers, keep_alive)
+
+
+async def _dispatch(service, method, path, body):
+    path = path.split('?', 1)[0]
+    if path == '/health':
+        if method != 'GET':
+            raise HTTPError(405, 'Use GET')
+        health = service.health()
+        return _json(200 if health['status'] == 'ok' else 503, health)
+
+    if path == '/transform':
+        if method != 'POST':
+            raise HTTPError(405, 'Use POST')
+        service.admit(1)
+        html = await service.transform(body)
+        return _response(200, html, 'text/html; charset=utf-8')
+
+    if path == '/batch':
+        if method != 'POST':
+            raise HTTPError(405, 'Use POST')
+        try:
+            documents = json.loads(body)['documents']
+            if not all(isinstance(d, dict) and isinstance(d.get('html'), str) for d in documents):
+                raise ValueError
+        except (ValueError, KeyError, TypeError):
+            raise HTTPError(400, 'Expected {"documents": [{"name": ..., "html": ...}, ...]}')
+        service.admit(len(documents))
+        results = await service.transform_batch(documents)
+        return _json(200, {'results': results})
+
+    raise HTTPError(404, f'No such endpoint: {path}')
+
+
+async def handle_connection(service, reader, writer):
+    """
+    Serve requests on one keep-alive connection until the client closes it.
+    """
+    try:
+        while True:
+            try:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                response = await _dispatch(service, method, path, body)
+            except HTTPError as e:
+                keep_alive = e.status not in (400, 411, 413, 431, 501)
+                response = _json(e.status, {'error': str(e)}, e.headers, keep_alive)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+            writer.write(response)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(service, host='127.0.0.1', port=8080):
+    server = await asyncio.start_server(
+        lambda r, w: handle_connection(service, r, w), host, port, limit=MAX_HEADER_BYTES)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    print(f'Serving on http://{host}:{port} with {service.jobs} workers, '
+          f'queue depth {service.queue_depth}, timeout {service.timeout:g}s')
+    async with server:
+        await stop.wait()
+    print('Shutting down...')
+    service.draining = True
+    await loop.run_in_executor(None, service.shutdown)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the HTML transform HTTP service.')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: %(default)s)')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on (default: %(default)s)')
+    parser.add_argument('--jobs', '-j', type=int, default=None, help='Worker processes (default: CPU count)')
+    parser.add_argument('--queue-depth', type=int, default=None,
+                        help='Documents queued or running before requests get 429 (default: 4 per worker)')
+    parser.add_argument('--timeout', type=float, default=30.0,
+                        help='Seconds before a document gets 504 (default: %(default)s)')
+    parser.add_argument('--parser', choices=PARSERS, default=DEFAULT_PARSER,
+                        help='HTML tree builder (default: %(default)s)')
+    parser.add_argument('--engine', choices=ENGINES, default='tree', help='Transform engine (default: %(default)s)')
+    parser.add_argument('--output-mode', choices=OUTPUT_MODES, default=DEFAULT_OUTPUT_MODE,
+                        help='Output mode (default: %(default)s)')
+    args = parser.parse_args()
+
+    service = TransformService(args.jobs, args.queue_depth, args.timeout, args.parser,
+                               args.engine, args.output_mode)
+    asyncio.run(serve(service, args.host, args.port))
+
+
+if __name__ == '__main__':
+    main()
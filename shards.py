@@ -0,0 +1,175 @@
+"""
+Deterministic sharding of directory runs across machines, and merging of the
+per-shard manifests.
+
+With ``--shard K/N`` a directory run only processes the templates whose
+relative path hashes to shard K of N, so N nodes given the same corpus split
+it between them without coordinating. Each shard appends one line per file to
+its own manifest; ``main.py merge`` combines the manifests and reports shards
+that are missing, files processed by more than one shard (or by the wrong
+one) and, given the corpus, files no shard processed.
+"""
+import hashlib
+import json
+import os
+
+from batch import order_key
+
+MANIFEST_PREFIX = 'shard-manifest'
+
+
+def parse_shard(text):
+    """
+    Parse 'K/N' into (K, N) with 1 <= K <= N.
+    """
+    try:
+        k, n = (int(part) for part in text.split('/'))
+    except ValueError:
+        raise ValueError(f"expected K/N, e.g. 1/4, got '{text}'") from None
+    if not 1 <= k <= n:
+        raise ValueError(f"shard must satisfy 1 <= K <= N, got '{text}'")
+    return k, n
+
+
+def shard_of(relative_path, n):
+    """
+    Return the shard (1 to ``n``) a template belongs to. The hash is taken
+    over the relative path with '/' separators, so it is the same on every
+    machine and platform.
+    """
+    key = relative_path.replace(os.sep, '/').encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'big') % n + 1
+
+
+def shard_name(name, shard):
+    """
+    Insert the shard into a file name, e.g. journal.jsonl ->
+    journal.shard-2-of-4.jsonl, so that shards can share an output directory.
+    """
+    if shard is None:
+        return name
+    base, ext = os.path.splitext(name)
+    return f'{base}.shard-{shard[0]}-of-{shard[1]}{ext}'
+
+
+def manifest_path(output_dir, shard):
+    return os.path.join(output_dir, shard_name(MANIFEST_PREFIX + '.jsonl', shard))
+
+
+class ShardManifest:
+    """
+    Append-only manifest of one shard's files. The first line records the
+    shard; each following line describes one file:
+
+        {"path", "input_sha256", "output", "status", "error", "seconds", "stages"}
+
+    ``stages`` maps each stage to its wall time in seconds. With
+    ``resume=True`` an existing manifest is appended to, so a retried file
+    gets a second line; the last one wins when merging.
+    """
+
+    def __init__(self, path, shard, resume=False):
+        self.path = path
+        mode = 'w'
+        if resume and os.path.exists(path):
+            _truncate_partial_line(path)
+            mode = 'a'
+        self.file = open(path, mode, encoding='utf-8')
+        if mode == 'w':
+            self.file.write(json.dumps({'shard': shard[0], 'shards': shard[1]}) + '\n')
+            self.file.flush()
+
+    def append(self, relative_path, record):
+        self.file.write(json.dumps({
+            'path': relative_path.replace(os.sep, '/'), 'input_sha256': record.get('sha256'),
+            'output': record['output'], 'status': record['status'], 'error': record['error'],
+            'seconds': record['seconds'],
+            'stages': {name: entry['seconds'] for name, entry in record['stages'].items()},
+        }) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def _truncate_partial_line(path):
+    with open(path, 'rb+') as f:
+        data_end = 0
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            data_end += len(line)
+        # Drop a line left half-written by a crash
+        f.truncate(data_end)
+
+
+def read_manifest(path):
+    """
+    Return ((K, N), {relative_path: entry}) for a shard manifest, keeping the
+    last entry of each path. A half-written last line is ignored.
+    """
+    shard = None
+    entries = {}
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            entry = json.loads(line)
+            if 'path' not in entry:
+                shard = (entry['shard'], entry['shards'])
+            else:
+                entries[entry['path']] = entry
+    if shard is None:
+        raise ValueError(f"'{path}' is not a shard manifest")
+    return shard, entries
+
+
+def merge_manifests(paths, expected=None):
+    """
+    Combine shard manifests. ``expected``, if given, is the set of relative
+    paths ('/' separators) the whole corpus should cover.
+
+    Returns (entries, problems): the merged entries in path order, each with
+    its 'shard' added, and a dict of lists:
+
+    - 'shards': shard numbers with no manifest, or a mismatched shard count
+    - 'duplicates': paths listed by more than one shard
+    - 'misplaced': paths listed by a shard they do not hash to
+    - 'missing': expected paths no shard listed
+    - 'failed': paths whose last attempt failed
+    """
+    problems = {'shards': [], 'duplicates': [], 'misplaced': [], 'missing': [], 'failed': []}
+    merged = {}
+    seen = {}
+    counts = set()
+    for path in paths:
+        (k, n), entries = read_manifest(path)
+        counts.add(n)
+        if k in seen:
+            problems['shards'].append(f'shard {k}/{n} given twice: {seen[k]} and {path}')
+        seen[k] = path
+        for relative, entry in entries.items():
+            entry = dict(entry, shard=k)
+            if relative in merged:
+                problems['duplicates'].append(relative)
+                continue
+            merged[relative] = entry
+            if shard_of(relative, n) != k:
+                problems['misplaced'].append(relative)
+            if entry['status'] == 'failed':
+                problems['failed'].append(relative)
+
+    if len(counts) > 1:
+        problems['shards'].append(f'manifests disagree on the shard count: {sorted(counts)}')
+    elif counts:
+        n = counts.pop()
+        problems['shards'].extend(f'shard {k}/{n} has no manifest' for k in range(1, n + 1) if k not in seen)
+    if expected is not None:
+        problems['missing'] = [path for path in expected if path not in merged]
+
+    def key(path):
+        return order_key(path.replace('/', os.sep))
+
+    for name in ('duplicates', 'misplaced', 'missing', 'failed'):
+        problems[name] = sorted(set(problems[name]), key=key)
+    return [merged[path] for path in sorted(merged, key=key)], problems
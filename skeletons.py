@@ -0,0 +1,168 @@
+"""
+Corpus-wide deduplication of transformed templates.
+
+Once text and images are replaced by placeholders, many templates of a corpus
+come out byte-identical, or nearly so. A SkeletonStore keeps one copy of each
+distinct output (a "skeleton"), named by its SHA-256, and writes a manifest
+mapping every source file to its skeleton. Each new skeleton also gets a
+MinHash signature over shingles of its tag/text token stream, so skeletons
+that differ only slightly are linked to the closest one seen before.
+"""
+import hashlib
+import json
+import os
+import random
+import re
+
+MANIFEST_NAME = 'manifest.jsonl'
+SHINGLE_SIZE = 4
+MINHASH_PERMUTATIONS = 64
+# Banding for locality-sensitive lookup: 16 bands of 4 signature values
+LSH_BANDS = 16
+DEFAULT_SIMILARITY = 0.9
+
+TOKEN_PATTERN = re.compile(r'<[^>]*>|[^<]+')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# XOR masks standing in for random permutations of the 64-bit shingle hashes
+_MASKS = [random.Random(seed).getrandbits(64) for seed in range(MINHASH_PERMUTATIONS)]
+
+
+def structural_tokens(html):
+    """
+    Return the tags and non-blank text runs of ``html`` with whitespace
+    collapsed, so that indentation does not affect similarity.
+    """
+    tokens = []
+    for token in TOKEN_PATTERN.findall(html):
+        token = WHITESPACE_PATTERN.sub(' ', token).strip()
+        if token:
+            tokens.append(token)
+    return tokens
+
+
+def minhash(tokens, shingle_size=SHINGLE_SIZE):
+    """
+    Return the MinHash signature (a tuple of MINHASH_PERMUTATIONS ints) of
+    the set of ``shingle_size``-token shingles of ``tokens``.
+    """
+    hashes = set()
+    for i in range(max(len(tokens) - shingle_size + 1, 1)):
+        shingle = '\x00'.join(tokens[i:i + shingle_size]).encode('utf-8')
+        hashes.add(int.from_bytes(hashlib.blake2b(shingle, digest_size=8).digest(), 'little'))
+    return tuple(min(map(mask.__xor__, hashes)) for mask in _MASKS)
+
+
+def similarity(a, b):
+    """
+    Estimate the Jaccard similarity of two documents from their signatures.
+    """
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+class SkeletonStore:
+    """
+    Stores each distinct transformed template once in ``directory`` and
+    appends one manifest line per source file to ``manifest_name`` there:
+
+        {"source", "skeleton", "new", "similar_to", "similarity"}
+
+    ``similar_to`` names the most similar earlier skeleton whose estimated
+    similarity is at least ``threshold``. Lines for new skeletons also carry
+    their signature, so with ``resume=True`` the index is rebuilt from an
+    existing manifest and the run continues where it left off. Sharded runs
+    sharing a directory each use their own ``manifest_name``.
+    """
+
+    def __init__(self, directory, threshold=DEFAULT_SIMILARITY, resume=False, manifest_name=MANIFEST_NAME):
+        self.directory = directory
+        self.threshold = threshold
+        self.signatures = {}
+        self.buckets = {}
+        self.sources = 0
+        self.near_duplicates = 0
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, manifest_name)
+        mode = 'w'
+        if resume and os.path.exists(path):
+            self._load(path)
+            mode = 'a'
+        self.manifest = open(path, mode, encoding='utf-8')
+
+    def _load(self, path):
+        with open(path, 'rb+') as f:
+            data_end = 0
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                data_end += len(line)
+                entry = json.loads(line)
+                self.sources += 1
+                if entry['new']:
+                    self._index(entry['skeleton'], tuple(entry['signature']))
+                if entry['similar_to']:
+                    self.near_duplicates += 1
+            # Drop a line left half-written by a crash
+            f.truncate(data_end)
+
+    def _bands(self, signature):
+        rows = len(signature) // LSH_BANDS
+        for band in range(LSH_BANDS):
+            yield band, signature[band * rows:(band + 1) * rows]
+
+    def _index(self, skeleton, signature):
+        self.signatures[skeleton] = signature
+        for key in self._bands(signature):
+            self.buckets.setdefault(key, []).append(skeleton)
+
+    def _nearest(self, signature):
+        candidates = {skeleton for key in self._bands(signature) for skeleton in self.buckets.get(key, ())}
+        best, best_score = None, 0.0
+        for skeleton in sorted(candidates):
+            score = similarity(signature, self.signatures[skeleton])
+            if score > best_score:
+                best, best_score = skeleton, score
+        if best_score < self.threshold:
+            return None, None
+        return best, round(best_score, 4)
+
+    def add(self, source, data):
+        """
+        Record the transformed bytes ``data`` of ``source`` and return its
+        manifest entry.
+        """
+        skeleton = hashlib.sha256(data).hexdigest()
+        entry = {'source': source, 'skeleton': skeleton, 'new': skeleton not in self.signatures,
+                 'similar_to': None, 'similarity': None}
+        if entry['new']:
+            signature = minhash(structural_tokens(data.decode('utf-8-sig', errors='replace')))
+            entry['similar_to'], entry['similarity'] = self._nearest(signature)
+            self._write(skeleton + '.html', data)
+            self._index(skeleton, signature)
+            entry['signature'] = list(signature)
+        if entry['similar_to']:
+            self.near_duplicates += 1
+        self.sources += 1
+        self.manifest.write(json.dumps(entry) + '\n')
+        self.manifest.flush()
+        return entry
+
+    def _write(self, name, data):
+        import tempfile
+
+        # Shards may share the directory, so each writer gets its own temporary name
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, os.path.join(self.directory, name))
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def add_file(self, source, path):
+        with open(path, 'rb') as f:
+            return self.add(source, f.read())
+
+    def close(self):
+        self.manifest.close()
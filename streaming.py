@@ -0,0 +1,422 @@
+"""
+Streaming token-level rewriter.
+
+An alternative to the BeautifulSoup engine for very large exports and
+memory-capped workers. The document is tokenized with the stdlib
+``html.parser.HTMLParser`` and each token is rewritten and written out as soon
+as its fate is known, so memory is bounded by nesting depth rather than
+document size. Only the <head> element (buffered until it closes so the UTF-8
+meta tags can be placed like ``ensure_utf8_meta_tag`` does), individual
+<style>/<script> blocks and the stylesheets seen so far are held in memory.
+
+The rules are the same rule objects the tree engine uses, so the output
+matches the html.parser tree path token for token, minus prettification.
+Differences by design:
+
+- An image sized only by a CSS class rule is resolved against the <style>
+  blocks seen before it, not ones that appear later in the document.
+- A <head> is only recognised if it is the first element inside <html>;
+  otherwise one is created there, as for documents without a head.
+"""
+import codecs
+import io
+from html import escape
+from html.parser import HTMLParser
+
+from engine import (
+    HTML_TOKEN_PATTERN, AnchorRule, BackgroundImageRule, FontFamilyRule, ImageRule, StylesheetRule, TextRule,
+    clean_text_content, normalize_pieces,
+)
+from reader import SNIFF_BYTES, candidate_encodings, open_source
+from stylesheet import ClassDimensionIndex, rewrite_stylesheet
+
+# Same element set BeautifulSoup's html.parser builder treats as void
+VOID_ELEMENTS = frozenset([
+    'area', 'base', 'basefont', 'bgsound', 'br', 'col', 'command', 'embed',
+    'frame', 'hr', 'image', 'img', 'input', 'isindex', 'keygen', 'link',
+    'menuitem', 'meta', 'nextid', 'param', 'source', 'spacer', 'track', 'wbr',
+])
+RAW_TEXT_ELEMENTS = frozenset(['style', 'script'])
+PRESERVE_WHITESPACE_ELEMENTS = frozenset(['pre', 'textarea'])
+ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+
+CHARSET_META = '<meta charset="UTF-8"/>'
+CONTENT_TYPE_META = '<meta content="text/html; charset=UTF-8" http_equiv="Content-Type"/>'
+
+CHUNK_SIZE = 64 * 1024
+# Distinct text runs normalize_html_chunks remembers before starting afresh
+MEMO_SIZE = 4096
+
+def normalize_html_chunks(chunks):
+    """
+    Incremental equivalent of ``normalize_html`` over a stream of text
+    chunks. The last text run or token of each chunk may continue in the
+    next one, so it is held back and scanned again with it; a <style> or
+    comment spanning several chunks is held until it ends.
+    """
+    started = False
+    carry = ''
+    memo = {}
+    for chunk in chunks:
+        pieces = HTML_TOKEN_PATTERN.split(carry + chunk)
+        carry = pieces.pop()
+        if not carry and pieces:
+            carry = pieces.pop()
+        if len(memo) > MEMO_SIZE:
+            memo.clear()
+        normalize_pieces(pieces, memo=memo)
+        text = ''.join(pieces)
+        if not started:
+            text = text.lstrip()
+            started = bool(text)
+        if text:
+            yield text
+
+    pieces = HTML_TOKEN_PATTERN.split(carry)
+    normalize_pieces(pieces, memo=memo)
+    tail = ''.join(pieces)
+    tail = tail.strip() if not started else tail.rstrip()
+    if tail:
+        yield tail
+
+
+class _Element:
+    __slots__ = ('name', 'children')
+
+    def __init__(self, name):
+        self.name = name
+        self.children = 0
+
+
+class StreamingRewriter(HTMLParser):
+    """
+    Apply transformation rules to HTML as it is fed, passing the rewritten
+    markup to ``write``. Call ``close`` after the last ``feed``.
+    """
+
+    def __init__(self, write, rules):
+        super().__init__(convert_charrefs=True)
+        self._write = write
+
+        self.text_placeholders = {}
+        self.image_rule = None
+        self.anchor_rule = None
+        self.style_rules = []
+        # Options of the single rewrite_stylesheet pass over each <style> block
+        self.stylesheet_options = {}
+        for rule in rules:
+            if isinstance(rule, TextRule):
+                self.text_placeholders.update(rule.placeholders)
+            elif isinstance(rule, ImageRule):
+                self.image_rule = rule
+            elif isinstance(rule, AnchorRule):
+                self.anchor_rule = rule
+            elif isinstance(rule, (FontFamilyRule, BackgroundImageRule)):
+                self.style_rules.append(rule)
+                if rule.stylesheets:
+                    self.stylesheet_options.update(rule.stylesheet_options)
+            elif isinstance(rule, StylesheetRule):
+                self.stylesheet_options.update(rule.options)
+            else:
+                raise ValueError(f'{type(rule).__name__} is not supported by the streaming engine')
+
+        self._stack = []
+        self._preserve_whitespace = 0
+        self._text = []
+        # A blank first child of a text tag, held until we know whether it is
+        # the tag's only child: (element, content, serialized markup)
+        self._held = None
+
+        # The first <head> is buffered until it closes; output between <html>
+        # and its first element is held until we know whether that is a head.
+        self._head_handled = False
+        self._head_element = None
+        self._head_chunks = None
+        self._awaiting_head = False
+        self._awaiting = []
+        self._charset_seen = False
+        self._content_type_seen = False
+
+        self._stylesheets = []
+        self._class_index = None
+
+    # Output
+
+    def _out(self, markup, head_child=False):
+        if self._head_chunks is not None:
+            if head_child or not self._head_chunks:
+                self._head_chunks.append([markup])
+            else:
+                self._head_chunks[-1].append(markup)
+        elif self._awaiting_head:
+            self._awaiting.append(markup)
+        else:
+            self._write(markup)
+
+    def _is_head_child(self, parent):
+        return parent is not None and parent is self._head_element
+
+    def _end_awaiting(self, head_follows):
+        self._awaiting_head = False
+        if not head_follows:
+            self._head_handled = True
+            self._write('<head>' + CHARSET_META + CONTENT_TYPE_META + '</head>')
+        for markup in self._awaiting:
+            self._write(markup)
+        self._awaiting = []
+
+    def _end_head(self):
+        chunks = self._head_chunks
+        self._head_chunks = None
+        self._head_element = None
+        if not self._charset_seen:
+            chunks.insert(0, [CHARSET_META])
+        if not self._content_type_seen:
+            chunks.insert(1, [CONTENT_TYPE_META])
+        for chunk in chunks:
+            for markup in chunk:
+                self._write(markup)
+
+    # Tags
+
+    def handle_starttag(self, tag, attrs):
+        self._start(tag, attrs, tag in VOID_ELEMENTS)
+
+    def handle_startendtag(self, tag, attrs):
+        self._start(tag, attrs, True)
+
+    def _start(self, name, attr_list, closed):
+        self._flush_text()
+        self._resolve_held(closing=False)
+
+        parent = self._stack[-1] if self._stack else None
+        if parent is not None:
+            parent.children += 1
+        if self._awaiting_head:
+            self._end_awaiting(head_follows=name == 'head')
+
+        attrs = {}
+        for key, value in attr_list:
+            attrs[key] = '' if value is None else value
+
+        if self._head_chunks is not None and name == 'meta':
+            if 'charset' in attrs and not self._charset_seen:
+                attrs['charset'] = 'UTF-8'
+                self._charset_seen = True
+            if attrs.get('http-equiv') == 'Content-Type':
+                self._content_type_seen = True
+        if name == 'img' and self.image_rule is not None:
+            self._rewrite_image(attrs)
+        if name == 'a' and self.anchor_rule is not None:
+            attrs['href'] = self.anchor_rule.href_placeholder
+        if 'style' in attrs:
+            for rule in self.style_rules:
+                attrs['style'] = rule.rewrite_style(attrs['style'])
+
+        markup = '<' + name + ''.join(
+            f' {key}="{escape(value)}"' for key, value in attrs.items()
+        )
+        if name in VOID_ELEMENTS:
+            self._out(markup + '/>', self._is_head_child(parent))
+            return
+        self._out(markup + '>', self._is_head_child(parent))
+
+        element = _Element(name)
+        self._stack.append(element)
+        if name in PRESERVE_WHITESPACE_ELEMENTS:
+            self._preserve_whitespace += 1
+        if name == 'head' and not self._head_handled:
+            self._head_handled = True
+            self._head_element = element
+            self._head_chunks = []
+        elif name == 'html' and not self._head_handled:
+            self._awaiting_head = True
+        if closed:
+            self._pop()
+
+    def handle_endtag(self, tag):
+        self._flush_text()
+        for index in range(len(self._stack) - 1, -1, -1):
+            if self._stack[index].name == tag:
+                break
+        else:
+            return
+        while len(self._stack) > index:
+            self._pop()
+
+    def _pop(self):
+        element = self._stack[-1]
+        self._resolve_held(closing=True)
+        self._stack.pop()
+        if element.name in PRESERVE_WHITESPACE_ELEMENTS:
+            self._preserve_whitespace -= 1
+        if element is self._head_element:
+            self._end_head()
+        elif self._awaiting_head and element.name == 'html':
+            self._end_awaiting(head_follows=False)
+        self._out('</' + element.name + '>')
+
+    # Character data, comments and declarations
+
+    def handle_data(self, data):
+        self._text.append(data)
+
+    def handle_comment(self, data):
+        self._node(data, '<!--' + data + '-->')
+
+    def handle_decl(self, decl):
+        self._node(decl, '<!' + decl + '>')
+
+    def handle_pi(self, data):
+        self._node(data, '<?' + data + '>')
+
+    def unknown_decl(self, data):
+        # CDATA-style sections end with "]]>", MSO conditionals with "]>"
+        if data.lower().startswith(('cdata', 'temp', 'ignore', 'include', 'rcdata')):
+            self._node(data, '<![' + data + ']]>')
+        else:
+            self._node(data, '<![' + data + ']>')
+
+    def _flush_text(self):
+        if not self._text:
+            return
+        data = ''.join(self._text)
+        self._text = []
+        parent = self._stack[-1] if self._stack else None
+        if parent is not None and parent.name in RAW_TEXT_ELEMENTS:
+            self._resolve_held(closing=False)
+            parent.children += 1
+            if parent.name == 'style':
+                data = self._rewrite_stylesheet(data)
+            self._out(data, self._is_head_child(parent))
+            return
+        self._add_child(data, escape(data, quote=False))
+
+    def _node(self, content, markup):
+        self._flush_text()
+        self._add_child(content, markup)
+
+    def _add_child(self, content, markup):
+        self._resolve_held(closing=False)
+        parent = self._stack[-1] if self._stack else None
+        if parent is None:
+            self._out(markup)
+            return
+        parent.children += 1
+        if not self._preserve_whitespace and not content.strip(ASCII_SPACES):
+            # BeautifulSoup stores blank strings (and empty comments) as a
+            # single space or newline; decide on what it would see
+            content = '\n' if '\n' in content else ' '
+        if (parent.children == 1 and parent.name in self.text_placeholders
+                and content and not content.strip()):
+            self._held = (parent, content, markup)
+            return
+        self._emit_child(parent, content, markup, only_child=False)
+
+    def _resolve_held(self, closing):
+        if self._held is None:
+            return
+        element, content, markup = self._held
+        self._held = None
+        only_child = closing and element is self._stack[-1] and element.children == 1
+        self._emit_child(element, content, markup, only_child)
+
+    def _emit_child(self, parent, content, markup, only_child):
+        # Text rules run before the anchor rule, as in pipeline.RULES
+        replacement = None
+        placeholder = self.text_placeholders.get(parent.name)
+        if placeholder is not None and (content if only_child else content.strip()):
+            replacement = placeholder
+        if parent.name == 'a' and self.anchor_rule is not None:
+            value = content if replacement is None else replacement
+            if value.strip():
+                replacement = self.anchor_rule.text_placeholder if clean_text_content(value) else ''
+        if replacement is not None:
+            markup = escape(replacement, quote=False)
+        if markup:
+            self._out(markup, self._is_head_child(parent))
+
+    # Rules
+
+    def _rewrite_stylesheet(self, css):
+        if self.image_rule is not None:
+            self._stylesheets.append(css)
+            self._class_index = None
+        if self.stylesheet_options:
+            css = rewrite_stylesheet(css, **self.stylesheet_options)
+        return css
+
+    def _rewrite_image(self, attrs):
+        view = dict(attrs)
+        if 'class' in view:
+            view['class'] = view['class'].split()
+        width, height, class_names = self.image_rule.size_from_markup(view)
+        if (not width or not height) and class_names and self._stylesheets:
+            if self._class_index is None:
+                self._class_index = ClassDimensionIndex(self._stylesheets)
+            width, height = self._class_index.lookup(class_names, width, height)
+        self.image_rule.apply_placeholder(attrs, width, height)
+
+    def close(self):
+        super().close()
+        self._flush_text()
+        while self._stack:
+            self._pop()
+
+
+def rewrite_stream(chunks, write, rules):
+    """
+    Normalize, rewrite and write out a document given as an iterable of text chunks.
+    """
+    rewriter = StreamingRewriter(write, rules)
+    for chunk in normalize_html_chunks(chunks):
+        rewriter.feed(chunk)
+    rewriter.close()
+
+
+def _decode_chunks(data, encoding):
+    """
+    Yield ``data`` (bytes, or a mmap from reader.open_source) decoded
+    CHUNK_SIZE bytes at a time, translating newlines as a text-mode file does.
+    """
+    decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder(encoding)(), translate=True)
+    with memoryview(data) as view:
+        for start in range(0, len(view), CHUNK_SIZE):
+            chunk = decoder.decode(view[start:start + CHUNK_SIZE])
+            if chunk:
+                yield chunk
+    chunk = decoder.decode(b'', final=True)
+    if chunk:
+        yield chunk
+
+
+def rewrite_bytes(data, output_path, rules, encodings=None):
+    """
+    Rewrite a document already read into memory (bytes, or a mmap from
+    reader.open_source) into ``output_path`` without building a DOM.
+
+    The encoding candidates are sniffed from the first bytes unless
+    ``encodings`` is given. A decoding error part way through restarts the
+    output with the next candidate, decoding the same ``data`` again rather
+    than reading the file again. Returns the encoding that was used.
+    """
+    if encodings is None:
+        encodings = candidate_encodings(data[:SNIFF_BYTES])
+    for encoding in encodings:
+        try:
+            with open(output_path, 'w', encoding='utf-8-sig') as dst:
+                rewrite_stream(_decode_chunks(data, encoding), dst.write, rules)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    raise ValueError("Could not decode the input with any of the attempted encodings")
+
+
+def rewrite_file(input_path, output_path, rules, encodings=None):
+    """
+    Rewrite ``input_path`` into ``output_path`` without building a DOM. The
+    file is read once (see reader.open_source and rewrite_bytes). Returns the
+    encoding that was used.
+    """
+    with open_source(input_path) as data:
+        return rewrite_bytes(data, output_path, rules, encodings)
@@ -0,0 +1,198 @@
+"""
+Helpers for reading information out of <style> blocks and rewriting them.
+"""
+import re
+from functools import lru_cache
+
+# ".name {body}" where name is a plain class token. The body is captured in a
+# lookahead so rules nested inside another rule's braces are still indexed.
+CLASS_RULE_PATTERN = re.compile(r'\.([^\s.{}]+)(?=\s*\{([^}]*)\})')
+CLASS_NAME_PATTERN = re.compile(r'[^\s.{}]+')
+RULE_WIDTH_PATTERN = re.compile(r'width\s*:\s*(\d+)px')
+RULE_HEIGHT_PATTERN = re.compile(r'height\s*:\s*(\d+)px')
+
+
+def _rule_dimensions(rule_content):
+    width_match = RULE_WIDTH_PATTERN.search(rule_content)
+    height_match = RULE_HEIGHT_PATTERN.search(rule_content)
+    return (
+        width_match.group(1) if width_match else None,
+        height_match.group(1) if height_match else None,
+    )
+
+
+@lru_cache(maxsize=256)
+def class_dimensions(css_content):
+    """
+    Map every class selector in a stylesheet to the (width, height) declared
+    by its first rule, either of which may be None.
+
+    Results are cached on the stylesheet text, so templates of a campaign that
+    share the same boilerplate CSS only pay for parsing it once.
+    """
+    dimensions = {}
+    for match in CLASS_RULE_PATTERN.finditer(css_content):
+        class_name = match.group(1)
+        if class_name not in dimensions:
+            dimensions[class_name] = _rule_dimensions(match.group(2))
+    return dimensions
+
+
+class ClassDimensionIndex:
+    """
+    Per-document index from CSS class name to the dimensions declared for it
+    in the document's <style> blocks.
+    """
+
+    def __init__(self, stylesheets):
+        self.stylesheets = list(stylesheets)
+        self.index = {}
+        for sheet_number, css_content in enumerate(self.stylesheets):
+            for class_name, dims in class_dimensions(css_content).items():
+                self.index.setdefault(class_name, []).append((sheet_number, dims))
+
+    def lookup(self, class_names, width=None, height=None):
+        """
+        Fill in whichever of width/height is missing from the rules of the given
+        classes. Stylesheets are consulted in document order and, within one
+        stylesheet, classes in the order they appear on the element.
+        """
+        found = []
+        for position, class_name in enumerate(class_names):
+            if CLASS_NAME_PATTERN.fullmatch(class_name):
+                entries = self.index.get(class_name, ())
+            else:
+                entries = self._search(class_name)
+            for sheet_number, dims in entries:
+                found.append((sheet_number, position, dims))
+
+        for _, _, (rule_width, rule_height) in sorted(found, key=lambda entry: entry[:2]):
+            if not width and rule_width:
+                width = rule_width
+            if not height and rule_height:
+                height = rule_height
+        return width, height
+
+    def _search(self, class_name):
+        # Class names that cannot be indexed as a single selector token fall
+        # back to a literal search of each stylesheet.
+        pattern = re.compile(rf'\.{re.escape(class_name)}\s*{{([^}}]*)}}')
+        entries = []
+        for sheet_number, css_content in enumerate(self.stylesheets):
+            match = pattern.search(css_content)
+            if match:
+                entries.append((sheet_number, _rule_dimensions(match.group(1))))
+        return entries
+
+
+# Comments, strings and url(...) are matched whole so their contents never
+# look like braces, semicolons or colons.
+CSS_TOKEN_PATTERN = re.compile(r"""(
+    /\*.*?(?:\*/|\Z)
+  | "(?:[^"\\]|\\.)*(?:"|\Z)
+  | '(?:[^'\\]|\\.)*(?:'|\Z)
+  | url\(\s*(?:"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|[^)"']*)\s*\)
+  | @[-\w]+
+  | [{};:]
+)""", re.IGNORECASE | re.DOTALL | re.VERBOSE)
+IMPORTANT_PATTERN = re.compile(r'!\s*important$', re.IGNORECASE)
+
+# At-rules whose block holds rules rather than declarations
+GROUP_AT_RULES = {'@media', '@supports', '@document', '@-moz-document', '@layer', '@container', '@scope'}
+BACKGROUND_PROPERTIES = {'background', 'background-image'}
+
+
+def tokenize(css):
+    """
+    Split a stylesheet into tokens: comments, strings, url()s, at-keywords
+    and the characters ``{};:``, with the text between them in between.
+    Joining the tokens gives back ``css`` exactly.
+    """
+    return [token for token in CSS_TOKEN_PATTERN.split(css) if token]
+
+
+def _is_url(token):
+    return token[:4].lower() == 'url(' and token.endswith(')')
+
+
+def _rewrite_declaration(tokens, font_family, background_url):
+    if ':' not in tokens:
+        return ''.join(tokens)
+    colon = tokens.index(':')
+    name = ''.join(token for token in tokens[:colon] if not token.startswith('/*')).strip().lower()
+
+    if name == 'font-family' and font_family:
+        before = ''.join(tokens[:colon])
+        value = ''.join(tokens[colon + 1:])
+        leading = before[:len(before) - len(before.lstrip())]
+        comments = ''.join(token for token in tokens[:colon] if token.startswith('/*'))
+        important = ' !important' if IMPORTANT_PATTERN.search(value.rstrip()) else ''
+        return (leading + comments + 'font-family: ' + font_family + important
+                + value[len(value.rstrip()):])
+
+    if name in BACKGROUND_PROPERTIES and background_url:
+        value = [f'url({background_url})' if _is_url(token) else token for token in tokens[colon + 1:]]
+        return ''.join(tokens[:colon + 1] + value)
+
+    return ''.join(tokens)
+
+
+@lru_cache(maxsize=256)
+def rewrite_stylesheet(css, font_family=None, background_url=None):
+    """
+    Rewrite a stylesheet in one pass over its tokens: every font-family
+    declaration gets the value ``font_family`` (keeping ``!important``) and
+    every url() in a background or background-image declaration points at
+    ``background_url``. Either rewrite is skipped when its argument is None.
+    Declarations may end in ``;`` or ``}``; @font-face blocks keep their
+    font-family, and comments, strings and @import are left untouched.
+
+    Results are cached on the stylesheet text, like class_dimensions.
+    """
+    out = []
+    # One entry per open block: None for a block of rules, True for a block
+    # of declarations and False for the declarations of @font-face.
+    blocks = []
+    prelude_at = None
+    declaration = []
+
+    for token in tokenize(css):
+        in_declarations = bool(blocks) and blocks[-1] is not None
+        if token == '{':
+            if in_declarations:
+                # A nested rule: what was read so far is its selector
+                prelude_at = next((t.lower() for t in declaration if t.startswith('@')), None)
+                out.extend(declaration)
+                declaration = []
+            out.append(token)
+            if prelude_at in GROUP_AT_RULES:
+                blocks.append(None)
+            else:
+                blocks.append(prelude_at != '@font-face')
+            prelude_at = None
+        elif in_declarations:
+            if token == ';' or token == '}':
+                if blocks[-1]:
+                    out.append(_rewrite_declaration(declaration, font_family, background_url))
+                else:
+                    out.extend(declaration)
+                declaration = []
+                out.append(token)
+                if token == '}':
+                    blocks.pop()
+            else:
+                declaration.append(token)
+        else:
+            if token == '}' and blocks:
+                blocks.pop()
+            elif token.startswith('@'):
+                prelude_at = token.lower()
+            elif token == ';':
+                prelude_at = None
+            out.append(token)
+
+    if declaration and blocks[-1]:
+        out.append(_rewrite_declaration(declaration, font_family, background_url))
+    else:
+        out.extend(declaration)
+    return ''.join(out)
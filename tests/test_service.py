@@ -0,0 +1,29 @@
+import asyncio
+import unittest
+
+from service import HTTPError, _read_request
+
+
+def read_request(data):
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return await _read_request(reader)
+    return asyncio.run(read())
+
+
+class ReadRequestTest(unittest.TestCase):
+    def test_body_of_content_length(self):
+        request = read_request(b'POST /transform HTTP/1.1\r\nContent-Length: 3\r\n\r\n<p>')
+        self.assertEqual(request, ('POST', '/transform', {'content-length': '3'}, b'<p>'))
+
+    def test_negative_content_length_is_rejected(self):
+        with self.assertRaises(HTTPError) as raised:
+            read_request(b'POST /transform HTTP/1.1\r\nContent-Length: -1\r\n\r\n')
+        self.assertEqual(raised.exception.status, 400)
+        self.assertEqual(str(raised.exception), 'Invalid Content-Length')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+"""
+Polling watcher that reports created and modified HTML templates.
+
+Snapshots of (mtime, size) are taken over the same templates a directory run
+processes (see batch.iter_templates), subdirectories included, so it works
+the same on local disks and network shares without extra dependencies.
+"""
+import os
+import time
+
+from batch import DEFAULT_EXCLUDE, DEFAULT_INCLUDE, iter_templates
+
+
+def snapshot(directory, include=DEFAULT_INCLUDE, exclude=DEFAULT_EXCLUDE, skip_dirs=()):
+    """
+    Return {relative_path: (mtime_ns, size)} for the templates under
+    ``directory`` that match ``include`` and not ``exclude``, skipping
+    ``skip_dirs`` (see batch.iter_templates).
+    """
+    files = {}
+    for relative, excluded in iter_templates(directory, include, exclude, skip_dirs):
+        if excluded:
+            continue
+        try:
+            stat = os.stat(os.path.join(directory, relative))
+        except FileNotFoundError:
+            continue
+        files[relative] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+def watch_directory(directory, on_change, interval=0.5, debounce=0.3, initial=None,
+                    include=DEFAULT_INCLUDE, exclude=DEFAULT_EXCLUDE, skip_dirs=()):
+    """
+    Call ``on_change(relative_path)`` for every template created or modified
+    under ``directory`` until interrupted. ``include``, ``exclude`` and
+    ``skip_dirs`` select the templates as for snapshot.
+
+    A change is reported once the file's mtime and size have stayed the same
+    for ``debounce`` seconds, so editors that write in several steps trigger
+    one call. ``initial`` is the snapshot already processed (default: the
+    directory as it is now).
+    """
+    def scan():
+        return snapshot(directory, include, exclude, skip_dirs)
+
+    processed = scan() if initial is None else dict(initial)
+    pending = {}
+
+    while True:
+        time.sleep(interval)
+        now = time.monotonic()
+        current = scan()
+
+        for name in list(processed):
+            if name not in current:
+                del processed[name]
+
+        for name, signature in current.items():
+            if processed.get(name) == signature:
+                pending.pop(name, None)
+                continue
+            seen = pending.get(name)
+            if seen is None or seen[0] != signature:
+                pending[name] = (signature, now)
+            elif now - seen[1] >= debounce:
+                del pending[name]
+                processed[name] = signature
+                on_change(name)